@@ -0,0 +1,93 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import utils.config as cfg
+
+
+#
+# CONSTANTS
+#
+DEFAULT_DOWNLOADS = 10      # Blobs downloaded in parallel (sync.downloads)
+DEFAULT_WORKERS = 4         # Downloaded blobs processed in parallel (sync.workers)
+
+
+class Downloader():
+    """ Downloads the blobs of many documents and hands every downloaded
+        blob to a separate processing stage (unzip, render etc.). Up to
+        max_downloads blobs are downloaded at the same time while up to
+        max_workers blobs are processed. Downloaded blobs wait for a free
+        worker in a bounded queue, so a slow processing stage also slows
+        down the downloads instead of keeping all blobs in memory.
+
+        The stages are scheduled by an asyncio event loop that runs in
+        the calling thread; requests of the (blocking) keep-alive session
+        of the client and the processing run in thread pools.
+
+        Usage:
+            errors = Downloader(client).run(ids, process)
+    """
+
+    def __init__(self, client, max_downloads=None, max_workers=None):
+        self.client = client
+        self.max_downloads = max(1, max_downloads or cfg.get("sync.downloads", DEFAULT_DOWNLOADS))
+        self.max_workers = max(1, max_workers or cfg.get("sync.workers", DEFAULT_WORKERS))
+
+
+    def run(self, ids, process):
+        """ Downloads the blobs of the items with the given ids and calls
+            process(id, raw_file) for every downloaded blob (a temporary
+            file that is closed afterwards, see get_raw_file). Returns a
+            dict with the exception of each item that failed.
+        """
+        return asyncio.run(self._run(list(ids), process))
+
+
+    async def _run(self, ids, process):
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue()
+        downloaded = asyncio.Queue(maxsize=self.max_workers)
+        errors = {}
+
+        for id in ids:
+            pending.put_nowait(id)
+
+        async def download(pool):
+            while not pending.empty():
+                id = pending.get_nowait()
+                try:
+                    raw_file = await loop.run_in_executor(pool, self._download, id)
+                except Exception as e:
+                    errors[id] = e
+                    continue
+                await downloaded.put((id, raw_file))
+
+        async def work(pool):
+            while True:
+                id, raw_file = await downloaded.get()
+                try:
+                    await loop.run_in_executor(pool, process, id, raw_file)
+                except Exception as e:
+                    errors[id] = e
+                finally:
+                    raw_file.close()
+                    downloaded.task_done()
+
+        with ThreadPoolExecutor(self.max_downloads) as download_pool, \
+             ThreadPoolExecutor(self.max_workers) as work_pool:
+            workers = [asyncio.ensure_future(work(work_pool))
+                    for _ in range(self.max_workers)]
+            await asyncio.gather(*[download(download_pool)
+                    for _ in range(min(self.max_downloads, len(ids)))])
+            await downloaded.join()
+
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return errors
+
+
+    def _download(self, id):
+        # Urls are requested right before the download as they expire
+        blob_url = self.client.get_blob_url(id)
+        return self.client.get_raw_file(blob_url)
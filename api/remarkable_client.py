@@ -1,13 +1,18 @@
 
 import os
-from io import BytesIO
-import requests
+import threading
+import tempfile
+import re
+import time
+from datetime import datetime
 from uuid import uuid4
 from pathlib import Path
 import json
 
 import utils.config as cfg
 from utils.helper import Singleton
+from api.downloader import Downloader, DEFAULT_DOWNLOADS
+from api.transport import Transport
 
 #
 # EVENTS
@@ -36,6 +41,21 @@ UPDATE_STATUS_URL = BASE_URL + "/document-storage/json/2/upload/update-status"
 UPLOAD_REQUEST_URL = BASE_URL + "/document-storage/json/2/upload/request"
 DELETE_ENTRY_URL = BASE_URL + "/document-storage/json/2/delete"
 
+# Blobs are downloaded in chunks of this size (sync.chunk_size_kb)
+DEFAULT_CHUNK_SIZE_KB = 1024
+
+# Blob urls are refreshed if they expire within this time (in seconds)
+BLOB_URL_MIN_LIFETIME = 60
+
+# Lifetime of blob urls whose expiry time is unknown (in seconds)
+BLOB_URL_DEFAULT_LIFETIME = 5 * 60
+
+# Requests to the cloud (see Transport)
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF_S = 0.5
+DEFAULT_MAX_BACKOFF_S = 30
+DEFAULT_REQUESTS_PER_SECOND = 20
+
 
 #
 # CLIENT
@@ -64,14 +84,90 @@ class RemarkableClient():
                     print(e)
 
 
+    class HttpSession(metaclass=Singleton):
+        """ Keep-alive connections shared by all clients and threads. The
+            pool keeps one connection per parallel download (sync.downloads)
+            and the authorization header is kept in memory, so the config
+            is not read for every request. Failed requests are retried and
+            requests are rate limited (sync.retries, sync.backoff_s,
+            sync.max_backoff_s and sync.requests_per_second).
+        """
+
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.transport = Transport(
+                pool_size=max(1, cfg.get("sync.downloads", DEFAULT_DOWNLOADS)),
+                retries=cfg.get("sync.retries", DEFAULT_RETRIES),
+                backoff=cfg.get("sync.backoff_s", DEFAULT_BACKOFF_S),
+                max_backoff=cfg.get("sync.max_backoff_s", DEFAULT_MAX_BACKOFF_S),
+                rate_limit=cfg.get("sync.requests_per_second", DEFAULT_REQUESTS_PER_SECOND))
+            self.set_user_token(cfg.get("authentication.user_token"))
+
+        def set_user_token(self, user_token):
+            headers = {"user-agent": USER_AGENT}
+            if user_token is not None:
+                headers["Authorization"] = "Bearer %s" % user_token
+
+            # Replaced (not changed) such that other threads always see
+            # a complete set of headers
+            with self.lock:
+                self.headers = headers
+
+        def request(self, method, url, headers=None, **kwargs):
+            _headers = dict(self.headers)
+            if headers is not None:
+                _headers.update(headers)
+            return self.transport.request(method, url, headers=_headers, **kwargs)
+
+
+    class BlobURLCache(metaclass=Singleton):
+        """ Download urls of blobs (BlobURLGet) together with the time
+            they expire (BlobURLGetExpires).
+        """
+
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.refresh_lock = threading.Lock()
+            self.urls = {}
+
+        def get(self, id):
+            """ Returns the url of the blob or None if it is not known
+                or if it expires within BLOB_URL_MIN_LIFETIME.
+            """
+            with self.lock:
+                url, expires = self.urls.get(id, (None, 0))
+            if expires - time.time() < BLOB_URL_MIN_LIFETIME:
+                return None
+            return url
+
+        def update(self, items):
+            urls = {}
+            for item in items:
+                url = item.get("BlobURLGet")
+                if not url:
+                    continue
+                urls[item["ID"]] = (url, _parse_expires(item.get("BlobURLGetExpires")))
+
+            with self.lock:
+                self.urls.update(urls)
+
+
     def __init__(self):
         self.test = True
         self.listener_handler = self.SignInListenerHandler()
+        self.http = self.HttpSession()
+        self.blob_urls = self.BlobURLCache()
 
     def listen_sign_in_event(self, subscriber):
         self.listener_handler.listen_sign_in_event(subscriber)
 
 
+    def get_stats(self):
+        """ Returns the number of retried and throttled requests.
+        """
+        return self.http.transport.stats()
+
+
     def sign_in(self, onetime_code=None):
         """ Load token. If not available the user must provide a
             one time code from https://my.remarkable.com/connect/remarkable
@@ -100,6 +196,7 @@ class RemarkableClient():
             auth = {"device_token": device_token,
                     "user_token": user_token}
             cfg.save({"authentication": auth})
+            self.http.set_user_token(user_token)
 
             # Inform all subscriber
             self.listener_handler.publish(EVENT_SUCCESS, auth)
@@ -119,11 +216,52 @@ class RemarkableClient():
 
         if response.ok:
             items = response.json()
+            self.blob_urls.update(items)
             return items[0]
 
         return None
 
 
+    def get_blob_url(self, id):
+        """ Returns the download url of the blob of the given item. Urls
+            are requested for all items at once and are reused until they
+            are about to expire.
+        """
+        url = self.blob_urls.get(id)
+        if url is not None:
+            return url
+
+        # Only one thread refreshes the urls, all others wait for it
+        with self.blob_urls.refresh_lock:
+            url = self.blob_urls.get(id)
+            if url is None:
+                self.prefetch_blob_urls()
+                url = self.blob_urls.get(id)
+
+        # Not listed yet (e.g. just uploaded)
+        if url is None:
+            item = self.get_item(id)
+            if item is None or not item.get("BlobURLGet"):
+                raise IOError("Could not get blob url of item %s" % id)
+            url = item["BlobURLGet"]
+
+        return url
+
+
+    def prefetch_blob_urls(self):
+        """ Requests the download urls of the blobs of all items.
+        """
+        response = self._request("GET", LIST_DOCS_URL, params={
+            "withBlob": True
+        })
+
+        if response.ok:
+            self.blob_urls.update(response.json())
+            return True
+
+        return False
+
+
     def delete_item(self, id, version):
 
         response = self._request("PUT", DELETE_ENTRY_URL, body=[{
@@ -152,12 +290,40 @@ class RemarkableClient():
         return None
 
 
-    def get_raw_file(self, blob_url):
-        stream = self._request("GET", blob_url, stream=True)
-        zip_io = BytesIO()
-        for chunk in stream.iter_content(chunk_size=8192):
-            zip_io.write(chunk)
-        return zip_io.getbuffer()
+    def get_raw_file(self, blob_url, chunk_size=None):
+        """ Downloads the blob into a temporary file, which is deleted
+            when it is closed. Only one chunk of chunk_size bytes (or
+            sync.chunk_size_kb) is kept in memory.
+        """
+        if chunk_size is None:
+            chunk_size = cfg.get("sync.chunk_size_kb", DEFAULT_CHUNK_SIZE_KB) * 1024
+
+        # Not in the temp dir as it could be kept in memory (tmpfs)
+        path_downloads = Path(cfg.CACHE_PATH) / "downloads"
+        path_downloads.mkdir(parents=True, exist_ok=True)
+
+        with self._request("GET", blob_url, stream=True) as response:
+            if not response.ok:
+                raise IOError("Download failed with status %d" % response.status_code)
+
+            raw_file = tempfile.TemporaryFile(dir=path_downloads)
+            try:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    raw_file.write(chunk)
+                raw_file.seek(0)
+            except:
+                raw_file.close()
+                raise
+        return raw_file
+
+
+    def download_all(self, ids, process, max_downloads=None, max_workers=None):
+        """ Downloads the blobs of the given items in parallel and calls
+            process(id, raw_file) for each of them (see Downloader).
+            Returns the exceptions of failed items by id.
+        """
+        downloader = Downloader(self, max_downloads, max_workers)
+        return downloader.run(ids, process)
 
 
     def upload(self, id, metadata, zip_file):
@@ -249,11 +415,6 @@ class RemarkableClient():
             the server.
         """
 
-        config = cfg.load()
-
-        if headers is None:
-            headers = {}
-
         if not path.startswith("http"):
             if not path.startswith('/'):
                 path = '/' + path
@@ -261,25 +422,26 @@ class RemarkableClient():
         else:
             url = path
 
-        _headers = {
-            "user-agent": USER_AGENT,
-        }
-
-        user_token = cfg.get("authentication.user_token")
-        if user_token != None:
-            _headers["Authorization"] = "Bearer %s" % user_token
-
-        for k in headers.keys():
-            _headers[k] = headers[k]
-
-        r = requests.request(method, url,
-                             json=body,
-                             data=data,
-                             headers=_headers,
-                             params=params,
-                             stream=stream,
-                             timeout=60*2)
+        r = self.http.request(method, url,
+                              json=body,
+                              data=data,
+                              headers=headers,
+                              params=params,
+                              stream=stream,
+                              timeout=60*2)
         return r
 
 
-
+#
+# HELPER
+#
+def _parse_expires(expires):
+    """ Returns the epoch time of an rfc3339 time (e.g. BlobURLGetExpires).
+    """
+    try:
+        # Fractions (nanoseconds) are ignored, the utc offset is kept
+        expires = re.sub(r"\.\d+", "", expires).replace("Z", "+00:00")
+        return datetime.fromisoformat(expires).timestamp()
+    except:
+        print("(Warning) Failed to parse expiry time of blob url.")
+        return time.time() + BLOB_URL_DEFAULT_LIFETIME
@@ -0,0 +1,151 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+#
+# CONSTANTS
+#
+RETRY_STATUS = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+MAX_RETRY_AFTER = 2 * 60       # Longer waits requested by the server are capped
+
+
+class Transport():
+    """ Keep-alive http session that retries failed requests and limits
+        the number of requests per second (rate_limit, 0 for no limit).
+
+        Requests are retried up to retries times with an exponential
+        backoff (starting at backoff seconds, at most max_backoff) and
+        jitter. Throttled requests (429) and requests that failed with a
+        server error or a connection error are retried; the latter only
+        if the request is idempotent. If the server sends Retry-After,
+        all requests wait that long. Retried requests are counted in
+        retries and throttled ones in throttles.
+    """
+
+    def __init__(self, pool_size=10, retries=5, backoff=0.5, max_backoff=30, rate_limit=0):
+        self.max_retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(rate_limit)
+
+        self.lock = threading.Lock()
+        self.retries = 0
+        self.throttles = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+
+    def request(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries or method.upper() not in IDEMPOTENT_METHODS:
+                    raise
+                response = None
+
+            if response is not None:
+                retry = response.status_code in RETRY_STATUS and attempt < self.max_retries
+                if response.status_code != 429 and method.upper() not in IDEMPOTENT_METHODS:
+                    retry = False
+                if not retry:
+                    return response
+
+            delay = self._get_delay(attempt, response)
+            with self.lock:
+                self.retries += 1
+                if response is not None and response.status_code == 429:
+                    self.throttles += 1
+
+            if response is not None:
+                response.close()
+                if response.status_code == 429 or "Retry-After" in response.headers:
+                    # The whole client is throttled, not only this request
+                    self.bucket.block(delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+    def stats(self):
+        with self.lock:
+            return {"retries": self.retries, "throttles": self.throttles}
+
+
+    def _get_delay(self, attempt, response):
+        retry_after = None if response is None else get_retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, MAX_RETRY_AFTER)
+
+        # Full jitter such that the workers do not retry all at once
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class TokenBucket():
+    """ Allows rate requests per second on average and bursts of up to
+        rate requests. A rate of 0 does not limit the requests.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+
+    def acquire(self):
+        """ Waits until the next request is allowed.
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0, self.blocked_until - now)
+            if self.rate > 0:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+    def block(self, seconds):
+        """ No requests are allowed for the given time.
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+#
+# HELPER
+#
+def get_retry_after(response):
+    """ Returns the seconds to wait given by the Retry-After header of the
+        response (seconds or http date) or None.
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
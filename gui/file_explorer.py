@@ -3,7 +3,6 @@ import sys
 import subprocess
 import threading
 import shutil
-import queue
 import uuid
 import webbrowser
 from time import gmtime, strftime
@@ -28,6 +27,10 @@ from model.document import Document
 import utils.config
 
 
+# Thumbnails of annotated pages shown for the selected document
+MAX_THUMBNAILS = 20
+
+
 class FileExplorer(object):
     """ Main window of RemaPy which displays the tree structure of
         all your rm documents and collections.
@@ -75,6 +78,14 @@ class FileExplorer(object):
         self.vsb.pack(side=tk.LEFT, fill='y')
         self.tree.configure(yscrollcommand=self.vsb.set)
 
+        # Thumbnails of the selected document
+        self.preview = tk.scrolledtext.ScrolledText(self.upper_frame, width=22, cursor="arrow")
+        self.preview.config(state=tk.DISABLED)
+        self.preview.pack(side=tk.LEFT, fill='y')
+        self.preview_id = None
+        self.preview_images = []
+        self.tree.bind("<<TreeviewSelect>>", self.tree_select_event_handler)
+
         self.hsb = ttk.Scrollbar(root, orient="horizontal", command=self.tree.xview)
         self.hsb.pack(fill='x')
         self.tree.configure(xscrollcommand=self.hsb.set)
@@ -312,6 +323,12 @@ class FileExplorer(object):
             pass
 
 
+    def tree_select_event_handler(self, *args):
+        selected_ids = self.tree.selection()
+        item = self.item_manager.get_item(selected_ids[0]) if len(selected_ids) == 1 else None
+        self._update_thumbnails_async(item)
+
+
     def _update_tree_item(self, item):
         if item.state == model.item.STATE_DELETED:
             self.tree.delete(item.id())
@@ -519,57 +536,118 @@ class FileExplorer(object):
 
 
     def _sync_items(self, items, force, open_file, open_original, open_oap):
-        q = queue.Queue()
-        threads = []
 
-        def worker():
-            while True:
-                item = q.get()
-                if item is None:
-                    break
+        # All items and child items
+        all_items = []
+        for item in items:
+            self.item_manager.traverse_tree(fun=all_items.append, item=item)
+
+        # Documents are downloaded in parallel and synced as soon as
+        # they are downloaded
+        documents = {item.id(): item for item in all_items
+                if item.is_document() and self._needs_sync(item, force)
+                and item.state != model.item.STATE_SYNCING}
+
+        def process(id, raw_file):
+            self._sync_and_open_item(documents[id], force, open_file,
+                    open_original, open_oap, raw_file=raw_file)
+
+        stats = self.rm_client.get_stats()
+        errors = self.rm_client.download_all(documents.keys(), process)
+        for id, e in errors.items():
+            self._log_sync_error(documents[id], open_file, e)
+
+        new_stats = self.rm_client.get_stats()
+        retries = new_stats["retries"] - stats["retries"]
+        throttles = new_stats["throttles"] - stats["throttles"]
+        if retries > 0:
+            self.log_console("(Warning) Retried %d requests (%d throttled by the cloud)" % (retries, throttles))
+
+        for item in all_items:
+            if item.id() in documents:
+                continue
+
+            try:
+                self._sync_and_open_item(item, force, open_file, open_original, open_oap)
+            except Exception as e:
+                self._log_sync_error(item, open_file, e)
 
-                try:
-                    self._sync_and_open_item(item, force, open_file, open_original, open_oap)
-                except Exception as e:
-                    if open_file:
-                        self.log_console("(Error) Could not open '%s'" % item.name())
-                    else:
-                        self.log_console("(Error) Could not sync '%s'" % item.name())
-                    print(e)
 
-                q.task_done()
+    def _needs_sync(self, item, force):
+        return (force or item.state != model.item.STATE_SYNCED) and not item.is_root()
 
-        num_worker_threads = 10
-        for i in range(num_worker_threads):
-            t = threading.Thread(target=worker)
-            t.start()
-            threads.append(t)
 
-        # Add all items and child items
-        for item in items:
-            self.item_manager.traverse_tree(fun=q.put, item = item)
+    def _log_sync_error(self, item, open_file, e):
+        if open_file:
+            self.log_console("(Error) Could not open '%s'" % item.name())
+        else:
+            self.log_console("(Error) Could not sync '%s'" % item.name())
+        print(e)
+
+
+    #
+    # Thumbnails
+    #
+    def _update_thumbnails_async(self, item):
+        """ Show the thumbnails of the annotated pages of the given item
+            (if it is a synced document). They are rendered in a thread
+            to keep the gui responsive...
+        """
+        self.preview_id = None if item is None else item.id()
+        if item is None or not item.is_document():
+            self._show_thumbnails(self.preview_id, [])
+            return
+
+        thread = threading.Thread(target=self._update_thumbnails, args=(item,))
+        thread.start()
+
+
+    def _update_thumbnails(self, item):
+        try:
+            thumbnails = item.thumbnails(max_pages=MAX_THUMBNAILS)
+        except Exception as e:
+            print("(Warning) Failed to render thumbnails of %s" % item.id())
+            print(e)
+            thumbnails = []
+
+        self._show_thumbnails(item.id(), thumbnails)
 
-        q.join()
 
-        # stop workers
-        for i in range(num_worker_threads):
-            q.put(None)
-        for t in threads:
-            t.join()
+    def _show_thumbnails(self, id, thumbnails):
+        # The selection changed in the meantime
+        if id != self.preview_id:
+            return
+
+        self.preview.config(state=tk.NORMAL)
+        self.preview.delete("1.0", tk.END)
+        self.preview_images = []
+        for page_nr, image in thumbnails:
+            photo = itk.PhotoImage(image)
+            self.preview_images.append(photo)
+            self.preview.insert(tk.END, "Page %d\n" % (page_nr + 1))
+            self.preview.image_create(tk.END, image=photo)
+            self.preview.insert(tk.END, "\n\n")
+        self.preview.config(state=tk.DISABLED)
 
 
-    def _sync_and_open_item(self, item, force, open_file, open_original, open_oap):
+    def _sync_and_open_item(self, item, force, open_file, open_original, open_oap, raw_file=None):
 
         if item.state == model.item.STATE_SYNCING:
             self.log_console("Already syncing '%s'" %  item.full_name())
             return
 
-        if (force or item.state != model.item.STATE_SYNCED) and not item.is_root():
-            item.sync()
+        if self._needs_sync(item, force):
+            if raw_file is None:
+                item.sync()
+            else:
+                item.sync(raw_file)
 
             if item.is_document():
                 self.log_console("Synced '%s'" %  item.full_name())
 
+                if item.id() == self.preview_id:
+                    self._update_thumbnails(item)
+
         if open_file and item.is_document():
             if open_original:
                 file_to_open = item.orig_file()
@@ -12,6 +12,7 @@ import json
 from api.remarkable_client import RemarkableClient
 from utils.helper import Singleton
 import model.render as render
+from model.files import ZipFiles
 import model.item
 from model.item import Item
 from model.collection import Collection
@@ -41,7 +42,6 @@ class Document(Item):
         super(Document, self).__init__(metadata, parent)
 
         # Remarkable tablet paths
-        self.path_zip = "%s.zip" % self.path
         self.path_rm_files = "%s/%s" % (self.path, self.id())
         self.path_content_file = "%s/%s.content" % (self.path, self.id())
 
@@ -51,10 +51,11 @@ class Document(Item):
         self.path_original_pdf = "%s/%s.pdf" % (self.path, self.id())
         self.path_original_epub = "%s/%s.epub" % (self.path, self.id())
         self.path_highlighter = "%s/%s.highlights/" % (self.path, self.id())
+        self.path_render = "%s/render" % self.path_remapy
+        self.path_rm_archive = "%s/pages.zip" % self.path_remapy
 
         # Other props
         self.download_url = None
-        self.blob_url = None
         self.state = None       # Synced, out of sync etc.
         self.type = None        # Unknown (not downloaded yet), pdf, epub or notebook
 
@@ -135,10 +136,36 @@ class Document(Item):
         if self.type == TYPE_NOTEBOOK:
             return self.path_annotated_pdf
 
-        if os.path.exists(self.path_oap_pdf):
-            return self.path_oap_pdf
+        # Rendered on first request from the overlays of the last sync.
+        # Documents synced before overlays were kept have an oap file only.
+        if not os.path.exists(self.path_render):
+            if os.path.exists(self.path_oap_pdf):
+                return self.path_oap_pdf
+            return None
 
-        return None
+        return render.oap(self.path_render, self.path_original_pdf, self.path_oap_pdf)
+
+
+    def thumbnails(self, width=render.DEFAULT_THUMBNAIL_WIDTH, max_pages=None):
+        """ Returns (page_nr, image) of the annotated pages of the synced
+            document (see render.thumbnail). The .rm files are read from
+            the archive that is kept by sync.
+        """
+        if not os.path.exists(self.path_content_file) or \
+           not os.path.exists(self.path_rm_archive):
+            return []
+
+        try:
+            pages = self.get_pages()
+            is_landscape = self.is_landscape()
+        except (KeyError, ValueError):
+            pages = []
+            is_landscape = False
+
+        with zipfile.ZipFile(self.path_rm_archive, "r") as zip_file:
+            files = ZipFiles(zip_file, self.path)
+            return render.thumbnails(self.path_rm_files, pages, is_landscape,
+                    width=width, max_pages=max_pages, files=files)
 
 
     def orig_file(self):
@@ -168,63 +195,112 @@ class Document(Item):
         return ok
 
 
-    def sync(self):
+    def sync(self, raw_file=None):
+        """ Downloads the document and renders the annotations. If the raw
+            file (zip) is already downloaded (see RemarkableClient.download_all)
+            it is used instead. The raw file is closed afterwards.
+        """
         if self.state == model.item.STATE_SYNCING:
             return
 
         self.state = model.item.STATE_SYNCING
         self._update_state_listener()
 
-        self._download_raw()
-        self._write_remapy_file()
-        self._update_state(inform_listener=False)
+        if raw_file is None:
+            blob_url = self.rm_client.get_blob_url(self.id())
+            raw_file = self.rm_client.get_raw_file(blob_url)
 
-        annotations_exist = os.path.exists(self.path_rm_files)
+        with raw_file, self._extract_raw(raw_file) as zip_file:
+            self._write_remapy_file()
+            self._update_state(inform_listener=False)
 
-        if self.type == TYPE_NOTEBOOK and annotations_exist:
-            render.notebook(
-                self.path,
-                self.id(),
-                self.path_annotated_pdf,
-                self.is_landscape(),
-                path_templates=cfg.get("general.templates"))
+            # Annotations are rendered directly from the downloaded zip
+            files = ZipFiles(zip_file, self.path)
+            annotations_exist = files.exists(self.path_rm_files)
 
-        else:
-            if annotations_exist:
-                # Also for epubs a pdf file exists which we can annotate :)
-                # We will then show the pdf rather than the epub...
-                render.pdf(
-                    self.path_rm_files,
-                    self.path_highlighter,
-                    self.get_pages(),
-                    self.path_original_pdf,
+            if self.type == TYPE_NOTEBOOK and annotations_exist:
+                render.notebook(
+                    self.path,
+                    self.id(),
                     self.path_annotated_pdf,
-                    self.path_oap_pdf)
+                    self.is_landscape(),
+                    path_templates=cfg.get("general.templates"),
+                    path_render=self.path_render,
+                    files=files,
+                    isolate=True)
+
+            else:
+                if annotations_exist:
+                    # Also for epubs a pdf file exists which we can annotate :)
+                    # We will then show the pdf rather than the epub...
+                    # Only annotated pages are rendered on request (see oap_file)
+                    render.pdf(
+                        self.path_rm_files,
+                        self.path_highlighter,
+                        self.get_pages(),
+                        self.path_original_pdf,
+                        self.path_annotated_pdf,
+                        None,
+                        path_render=self.path_render,
+                        files=files,
+                        isolate=True)
+                else:
+                    # Overlays of removed annotations
+                    shutil.rmtree(self.path_render, ignore_errors=True)
+                    if os.path.exists(self.path_annotated_pdf):
+                        os.remove(self.path_annotated_pdf)
 
         self._update_state()
         self.parent().sync()
 
 
-    def _download_raw(self, path=None):
+    def _extract_raw(self, raw_file, path=None):
+        """ Extracts the downloaded document (see get_raw_file) and returns
+            the zip file. Only the top level files (.content, .pagedata,
+            the original pdf or epub) are extracted; rendering reads the .rm
+            files and highlights from the returned zip (see ZipFiles). The
+            .rm files are also kept in a single archive for thumbnails.
+        """
         path = self.path if path == None else path
 
+        # Keep the render manifest and the annotated pdf such that
+        # unchanged pages are not rendered (or written) again
+        path_keep = "%s.keep" % self.path
+        keep = [p for p in (self.path_render, self.path_annotated_pdf)
+                if path == self.path and os.path.exists(p)]
+        if keep:
+            shutil.rmtree(path_keep, ignore_errors=True)
+            Path(path_keep).mkdir(parents=True)
+            for i, p in enumerate(keep):
+                os.replace(p, os.path.join(path_keep, str(i)))
+
         if os.path.exists(path):
             shutil.rmtree(path)
 
-        if self.blob_url == None:
-            self.blob_url = self.rm_client.get_item(self.id())["BlobURLGet"]
-
-        raw_file = self.rm_client.get_raw_file(self.blob_url)
-        with open(self.path_zip, "wb") as out:
-            out.write(raw_file)
-
-        with zipfile.ZipFile(self.path_zip, "r") as zip_ref:
-            zip_ref.extractall(path)
-
-        os.remove(self.path_zip)
+        zip_file = zipfile.ZipFile(raw_file, "r")
+        page_files = []
+        for info in zip_file.infolist():
+            if "/" not in info.filename:
+                zip_file.extract(info, path)
+            elif info.filename.startswith("%s/" % self.id()) and not info.is_dir():
+                page_files.append(info)
+
+        if keep:
+            Path(self.path_remapy).mkdir(parents=True, exist_ok=True)
+            for i, p in enumerate(keep):
+                os.replace(os.path.join(path_keep, str(i)), p)
+            shutil.rmtree(path_keep, ignore_errors=True)
+
+        if page_files and path == self.path:
+            Path(self.path_remapy).mkdir(parents=True, exist_ok=True)
+            with zipfile.ZipFile(self.path_rm_archive, "w") as archive:
+                for info in page_files:
+                    archive.writestr(info.filename, zip_file.read(info),
+                            compress_type=info.compress_type)
 
         # Update state
         self._update_state(inform_listener=False)
+        return zip_file
 
 
     def update_state(self):
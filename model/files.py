@@ -0,0 +1,108 @@
+import os
+import os.path
+
+
+class DiskFiles(object):
+    """ Read access to the files of a document for the renderer. The
+        default are files on disk; see ZipFiles to render a downloaded
+        document without extracting it.
+    """
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+
+    def listdir(self, path):
+        """ Names of the files and folders in path or an empty list if
+            path is not a folder.
+        """
+        if not os.path.isdir(path):
+            return []
+        return os.listdir(path)
+
+
+class ZipFiles(DiskFiles):
+    """ Files of a downloaded document (zip archive) which are read as if
+        the archive was extracted to path. Files outside of path are
+        read from disk.
+    """
+
+    def __init__(self, zip_file, path):
+        self.zip_file = zip_file
+        self.path = os.path.normpath(path)
+        self.names = set(zip_file.namelist())
+
+        # Folders are not always part of the archive
+        self.folders = set()
+        for name in self.names:
+            parts = name.split("/")[:-1]
+            for i in range(1, len(parts) + 1):
+                self.folders.add("/".join(parts[:i]))
+
+
+    def exists(self, path):
+        name = self._get_name(path)
+        if name is None:
+            return super(ZipFiles, self).exists(path)
+        return name in self.names or name.rstrip("/") in self.folders
+
+
+    def read(self, path):
+        name = self._get_name(path)
+        if name is None:
+            return super(ZipFiles, self).read(path)
+        return self.zip_file.read(name)
+
+
+    def listdir(self, path):
+        name = self._get_name(path)
+        if name is None:
+            return super(ZipFiles, self).listdir(path)
+
+        prefix = name.rstrip("/") + "/"
+        names = set()
+        for member in self.names | self.folders:
+            if member.startswith(prefix) and len(member) > len(prefix):
+                names.add(member[len(prefix):].split("/")[0])
+        return sorted(names)
+
+
+    def _get_name(self, path):
+        """ Returns the name of the member for path or None if path is
+            not inside of the archive.
+        """
+        name = os.path.relpath(os.path.normpath(path), self.path)
+        if name == os.curdir or name.startswith(os.pardir):
+            return None
+        return name.replace(os.sep, "/")
+
+
+class MemoryFiles(DiskFiles):
+    """ Files that are already loaded (path -> bytes). Used to send the
+        files of a page to a worker process.
+    """
+
+    def __init__(self, files, paths):
+        self.data = {}
+        for path in paths:
+            if path is not None and files.exists(path):
+                self.data[path] = files.read(path)
+
+
+    def exists(self, path):
+        return path in self.data
+
+
+    def read(self, path):
+        return self.data[path]
+
+
+    def listdir(self, path):
+        path = os.path.normpath(path)
+        return [os.path.basename(p) for p in self.data
+                if os.path.dirname(os.path.normpath(p)) == path]
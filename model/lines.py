@@ -0,0 +1,158 @@
+""" Reader of the .rm files (old .lines) of the reMarkable. See also
+    https://plasma.ninja/blog/devices/remarkable/binary/format/2017/12/26/reMarkable-lines-file-format.html
+
+    The source can be bytes, a memoryview or an mmap. Strokes are decoded
+    lazily and their columns are views on the source (nothing is copied).
+    An mmap can therefore only be closed after every stroke (and column)
+    is released, otherwise closing it raises BufferError. Columns that
+    are kept longer must be copied (e.g. stroke["x"].copy()).
+
+    Usage:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            xs = [stroke["x"].copy() for _, stroke in lines.iter_strokes(data)]
+"""
+import struct
+
+import numpy as np
+
+
+HEADER_V3 = b'reMarkable .lines file, version=3          '
+HEADER_V5 = b'reMarkable .lines file, version=5          '
+STROKE_FMT_V3 = '<IIIfI'
+STROKE_FMT_V5 = '<IIIffI'
+SEGMENT_DTYPE = np.dtype([
+    ("x", "<f4"),
+    ("y", "<f4"),
+    ("speed", "<f4"),
+    ("tilt", "<f4"),
+    ("width", "<f4"),
+    ("pressure", "<f4")])
+
+
+class LinesFileError(Exception):
+    """ Raised if the data is not a valid .rm file.
+    """
+    pass
+
+
+def get_version(data):
+    """ Returns the version (3 or 5) of the .rm file or None if the
+        header is unknown.
+    """
+    header = bytes(data[:len(HEADER_V5)])
+    if header == HEADER_V3:
+        return 3
+    if header == HEADER_V5:
+        return 5
+    return None
+
+
+def iter_layers(data):
+    """ Yields (layer, strokes_count, offset) for every layer without
+        decoding any stroke. offset is the position of the first stroke.
+    """
+    data = memoryview(data)
+    version, nlayers, offset = _read_header(data)
+    stroke_fmt = STROKE_FMT_V3 if version == 3 else STROKE_FMT_V5
+
+    for layer in range(nlayers):
+        strokes_count = _unpack('<I', data, offset)[0]
+        offset += 4
+        yield layer, strokes_count, offset
+
+        for _ in range(strokes_count):
+            offset = _skip_stroke(data, offset, stroke_fmt)
+
+
+def iter_strokes(data, layers=None):
+    """ Yields (layer, stroke) for all strokes of the given layers (or all
+        layers if None). A stroke is a dict with the header of the stroke
+        (pen_nr, color, pen_width) and the columns of its segments
+        (x, y, speed, tilt, width, pressure). Strokes of other layers
+        are skipped without decoding them.
+    """
+    data = memoryview(data)
+    version, nlayers, offset = _read_header(data)
+    stroke_fmt = STROKE_FMT_V3 if version == 3 else STROKE_FMT_V5
+
+    for layer in range(nlayers):
+        strokes_count = _unpack('<I', data, offset)[0]
+        offset += 4
+
+        is_skipped = layers is not None and layer not in layers
+        for _ in range(strokes_count):
+            if is_skipped:
+                offset = _skip_stroke(data, offset, stroke_fmt)
+                continue
+
+            stroke, offset = _read_stroke(data, offset, stroke_fmt)
+            yield layer, stroke
+
+
+def read_layers(data):
+    """ Returns all layers of the .rm file as lists of strokes
+        (see iter_strokes).
+    """
+    _, nlayers, _ = _read_header(memoryview(data))
+    layers = [[] for _ in range(nlayers)]
+    for layer, stroke in iter_strokes(data):
+        layers[layer].append(stroke)
+    return layers
+
+
+#
+# HELPER
+#
+def _read_header(data):
+    if len(data) < len(HEADER_V5) + 4:
+        raise LinesFileError("File too short to be a valid file")
+
+    version = get_version(data)
+    nlayers = _unpack('<I', data, len(HEADER_V5))[0]
+    offset = len(HEADER_V5) + 4
+    if version is None or nlayers < 1:
+        raise LinesFileError("Not a valid reMarkable file: <header=%s><nlayers=%d>" % (
+            bytes(data[:len(HEADER_V5)]), nlayers))
+
+    # Every layer needs at least its strokes count
+    if nlayers > (len(data) - offset) // 4:
+        raise LinesFileError("File too short for %d layers" % nlayers)
+
+    return version, nlayers, offset
+
+
+def _read_stroke(data, offset, stroke_fmt):
+    values = _unpack(stroke_fmt, data, offset)
+    offset += struct.calcsize(stroke_fmt)
+    pen_nr, color, pen_width, segments_count = values[0], values[1], values[3], values[-1]
+
+    end = offset + segments_count * SEGMENT_DTYPE.itemsize
+    if end > len(data):
+        raise LinesFileError("Stroke with %d segments exceeds the file at offset %d" % (
+            segments_count, offset))
+    segments = np.frombuffer(data, dtype=SEGMENT_DTYPE, count=segments_count, offset=offset)
+
+    stroke = {
+        "pen_nr": pen_nr,
+        "color": color,
+        "pen_width": pen_width,
+    }
+    for name in SEGMENT_DTYPE.names:
+        stroke[name] = segments[name]
+    return stroke, end
+
+
+def _skip_stroke(data, offset, stroke_fmt):
+    segments_count = _unpack(stroke_fmt, data, offset)[-1]
+    end = offset + struct.calcsize(stroke_fmt) + segments_count * SEGMENT_DTYPE.itemsize
+    if end > len(data):
+        raise LinesFileError("Stroke with %d segments exceeds the file at offset %d" % (
+            segments_count, offset))
+    return end
+
+
+def _unpack(fmt, data, offset):
+    try:
+        return struct.unpack_from(fmt, data, offset)
+    except struct.error:
+        raise LinesFileError("Unexpected end of file at offset %d" % offset)
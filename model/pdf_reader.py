@@ -0,0 +1,101 @@
+from collections.abc import Sequence
+
+from pdfrw import PdfReader, PdfName
+from pdfrw.objects.pdfindirect import PdfIndirect
+
+
+class LazyPdfReader(PdfReader):
+    """ PdfReader that loads a page (and the nodes of the page tree above
+        it) only when it is accessed. pdfrw.PdfReader loads all pages when
+        the pdf is opened, so opening a large pdf to change a few pages
+        would take as long as changing all of them. Pages are found with
+        the page counts (/Count) of the page tree. If the page tree is not
+        valid, all pages are loaded as by pdfrw.
+
+        Usage:
+            reader = LazyPdfReader(fdata=data)
+            page = reader.pages[1999]
+    """
+
+    def readpages(self, node):
+        try:
+            return PageTree(node.Pages, lambda: super(LazyPdfReader, self).readpages(node))
+        except (AttributeError, TypeError, ValueError):
+            return super(LazyPdfReader, self).readpages(node)
+
+
+class PageTree(Sequence):
+    """ The pages of a page tree (/Pages), loaded on access.
+    """
+
+    def __init__(self, root, readpages):
+        self.root = root
+        self.count = int(root.Count)
+        self.readpages = readpages
+        self.pages = None
+        if root.Type != PdfName.Pages or root.Kids is None:
+            raise ValueError("Invalid page tree")
+
+
+    def __len__(self):
+        return self.count if self.pages is None else len(self.pages)
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("Page index out of range")
+
+        if self.pages is None:
+            page = self._find(index)
+            if page is not None:
+                return page
+            self.pages = self.readpages()
+        return self.pages[index]
+
+
+    def _find(self, index):
+        """ Returns the page with the given index or None if the page
+            tree is not valid.
+        """
+        try:
+            node = self.root
+            while node.Type == PdfName.Pages:
+                kids = node.Kids
+                if int(node.Count) == len(kids):
+                    # Every kid is a page (or a tree with a single page)
+                    node = _get_kid(kids, index)
+                    if node.Type == PdfName.Pages and int(node.Count) != 1:
+                        return None
+                    index = 0
+                    continue
+
+                for i in range(len(kids)):
+                    kid = _get_kid(kids, i)
+                    count = int(kid.Count) if kid.Type == PdfName.Pages else 1
+                    if index < count:
+                        node = kid
+                        break
+                    index -= count
+                else:
+                    return None
+
+            if node.Type != PdfName.Page or index != 0:
+                return None
+            return node
+        except (AttributeError, TypeError, ValueError, IndexError):
+            return None
+
+
+def _get_kid(kids, index):
+    """ Loads only the kid with the given index, while indexing a pdfrw
+        PdfArray loads all of its elements.
+    """
+    kid = list.__getitem__(kids, index)
+    if isinstance(kid, PdfIndirect):
+        kid = kid.real_value()
+    return kid
@@ -0,0 +1,428 @@
+import weakref
+
+from pdfrw import PdfName, PdfArray, PdfDict, IndirectPdfDict, PdfObject
+from pdfrw.errors import PdfOutputError
+from pdfrw.pdfwriter import user_fmt
+from pdfrw.py23_diffs import convert_store
+
+
+# Object numbers of the catalog and the page tree root
+CATALOG_OBJNUM = 1
+PAGES_OBJNUM = 2
+
+
+class PdfStreamWriter(object):
+    """ Writes a pdf file page by page. In contrast to pdfrw.PdfWriter,
+        which formats the whole document in memory before anything is
+        written, every object is written to the file as soon as the page
+        that uses it is added. Objects that are still alive are written
+        only once and shared between pages (e.g. fonts of the original pdf).
+        Objects that are freed after a page was added (e.g. an overlay of a
+        single page) are forgotten, so memory does not grow with the number
+        of pages. fname is a path or a binary file object (e.g. BytesIO),
+        which is not closed by the writer.
+
+        Usage:
+            writer = PdfStreamWriter(path)
+            writer.reserve(original_pdf.pages)
+            for page in pages:
+                writer.addpage(page, original=...)
+            writer.close()
+    """
+
+    def __init__(self, fname, version="1.3"):
+        self._open(fname)
+        self.objnum = PAGES_OBJNUM
+        self.page_refs = []
+
+        # Original pages (and their parents) that are replaced by pages
+        # of this writer
+        self.reserved = {}
+        self.reserved_objs = []
+
+        self._write("%%PDF-%s\n%%\xe2\xe3\xcf\xd3\n" % version)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._close_file()
+
+
+    def reserve(self, pages):
+        """ References to the given (original) pages are written as
+            references to the pages added with addpage(page, original=...).
+        """
+        for page in pages:
+            self.reserved[id(page)] = self._next_objnum()
+            self.reserved_objs.append(page)
+
+            parent = page.Parent
+            while parent is not None and id(parent) not in self.reserved:
+                self.reserved[id(parent)] = PAGES_OBJNUM
+                self.reserved_objs.append(parent)
+                parent = parent.Parent
+
+
+    def addpage(self, page, original=None):
+        if page.Type != PdfName.Page:
+            raise PdfOutputError("Bad /Type:  Expected %s, found %s"
+                                 % (PdfName.Page, page.Type))
+
+        inheritable = page.inheritable
+        new_page = IndirectPdfDict(
+            page,
+            Resources=inheritable.Resources,
+            MediaBox=inheritable.MediaBox,
+            CropBox=inheritable.CropBox,
+            Rotate=inheritable.Rotate,
+        )
+        new_page.Parent = self._ref(PAGES_OBJNUM)
+
+        objnum = self.reserved.get(id(original if original is not None else page))
+        if objnum is None or objnum in self.offsets:
+            objnum = self._next_objnum()
+
+        self.page_refs.append(self._ref(objnum))
+        self._write_obj(objnum, new_page)
+
+
+    def close(self):
+        if self.closed:
+            return
+
+        # Reserved pages that were never added
+        for objnum in set(self.reserved.values()):
+            if objnum not in self.offsets and objnum != PAGES_OBJNUM:
+                self._write_raw_obj(objnum, "null")
+
+        pages = PdfDict(
+            Type=PdfName.Pages,
+            Count=PdfObject(len(self.page_refs)),
+            Kids=PdfArray(self.page_refs))
+        self._write_obj(PAGES_OBJNUM, pages)
+
+        catalog = PdfDict(Type=PdfName.Catalog, Pages=self._ref(PAGES_OBJNUM))
+        self._write_obj(CATALOG_OBJNUM, catalog)
+
+        size = self.objnum + 1
+        xref_offset = self.offset
+        self._write("xref\n0 %s\n" % size)
+        self._write("%010d %05d %s\r\n" % (0, 65535, "f"))
+        for objnum in range(1, size):
+            self._write("%010d %05d %s\r\n" % (self.offsets[objnum], 0, "n"))
+
+        trailer = PdfDict(Root=self._ref(CATALOG_OBJNUM), Size=PdfObject(size))
+        self._write("trailer\n\n%s\nstartxref\n%s\n%%%%EOF\n" % (
+            self._format(trailer, []), xref_offset))
+        self._close_file()
+
+
+    #
+    # HELPER
+    #
+    def _open(self, fname, mode="wb"):
+        self.is_own_file = not hasattr(fname, "write")
+        self.f = open(fname, mode) if self.is_own_file else fname
+        self.closed = False
+        self.offset = 0
+        self.offsets = {}
+
+        # Maps id(obj) -> objnum; entries are removed if obj is freed
+        self.indirect = {}
+        self.constants = []
+
+
+    def _close_file(self):
+        self.closed = True
+        if self.is_own_file:
+            self.f.close()
+        else:
+            self.f.flush()
+
+
+    def _next_objnum(self):
+        self.objnum += 1
+        return self.objnum
+
+
+    def _ref(self, objnum):
+        ref = PdfObject("%s 0 R" % objnum)
+        ref.indirect = True
+        return ref
+
+
+    def _write(self, s):
+        s = convert_store(s)
+        self.f.write(s)
+        self.offset += len(s)
+
+
+    def _write_raw_obj(self, objnum, formatted):
+        self.offsets[objnum] = self.offset
+        self._write("%s 0 obj\n%s\nendobj\n" % (objnum, formatted))
+
+
+    def _write_obj(self, objnum, obj):
+        """ Write obj and afterwards all new objects referenced by obj.
+        """
+        pending = [(objnum, obj)]
+        while pending:
+            objnum, obj = pending.pop()
+            self._write_raw_obj(objnum, self._format(obj, pending))
+
+
+    def _add(self, obj, pending):
+        """ Returns the reference of an indirect object (and schedules it
+            for writing if it is new) or formats a direct object.
+        """
+        if isinstance(obj, PdfDict):
+            indirect = obj.indirect or (obj.stream is not None)
+        else:
+            indirect = getattr(obj, "indirect", False)
+
+        if not indirect:
+            return self._format(obj, pending)
+
+        # Already formatted references
+        if isinstance(obj, PdfObject):
+            return str(obj)
+
+        objid = id(obj)
+        objnum = self.reserved.get(objid) or self.indirect.get(objid)
+        if objnum is not None:
+            return "%s 0 R" % objnum
+
+        objnum = self._next_objnum()
+        self.indirect[objid] = objnum
+        try:
+            weakref.finalize(obj, self.indirect.pop, objid, None)
+        except TypeError:
+            # Not weak referenceable, so keep it alive
+            self.constants.append(obj)
+        pending.append((objnum, obj))
+        return "%s 0 R" % objnum
+
+
+    def _format(self, obj, pending):
+        if isinstance(obj, (list, tuple)):
+            return _format_array([self._add(x, pending) for x in obj], "[%s]")
+
+        if isinstance(obj, dict):
+            if not isinstance(obj, PdfDict):
+                obj = PdfDict(obj)
+            pairs = sorted((getattr(x, "encoded", None) or x, y)
+                           for (x, y) in obj.iteritems())
+            items = []
+            for key, value in pairs:
+                items.append(key)
+                items.append(self._add(value, pending))
+            result = _format_array(items, "<<%s>>")
+            stream = obj.stream
+            if stream is not None:
+                result = "%s\nstream\n%s\nendstream" % (result, stream)
+            return result
+
+        if hasattr(obj, "indirect"):
+            return str(getattr(obj, "encoded", None) or obj)
+        return user_fmt(obj)
+
+
+class PdfUpdateWriter(PdfStreamWriter):
+    """ Writes a pdf as incremental update of an original pdf. The
+        original is copied byte by byte and only the pages that are
+        replaced (and the new objects they use) are appended together
+        with a cross-reference section for these objects. Objects of the
+        original are referenced, not written again, and pages that are
+        not replaced are never formatted. The time to write the pdf
+        therefore depends on the number of replaced pages and not on the
+        length of the original. See is_supported for the originals that
+        can be updated.
+
+        A pdf written by this writer can be updated again by appending
+        another update (see append). After close, startxref and objnum
+        are the values that are needed to append.
+
+        Usage:
+            original_pdf = PdfReader(fdata=data)
+            with PdfUpdateWriter(path, data, original_pdf) as writer:
+                writer.addpage(page, original=original_pdf.pages[i])
+            with PdfUpdateWriter.append(path, original_pdf, writer.startxref, writer.objnum) as writer:
+                writer.addpage(original_pdf.pages[i], original=original_pdf.pages[i])
+    """
+
+    def __init__(self, fname, data, reader, startxref=None, objnum=None):
+        self.is_append = data is None
+        self._open(fname, "ab" if self.is_append else "wb")
+        self.reader = reader
+        self.reserved = {}
+
+        if self.is_append:
+            self.offset = self.start = self.f.tell()
+            self.startxref = startxref
+            self.objnum = objnum
+            return
+
+        self.startxref = get_startxref(data)
+        self.objnum = int(reader.Size) - 1
+        self.f.write(data)
+        self.offset += len(data)
+        if not data.endswith(b"\n"):
+            self._write("\n")
+
+
+    @classmethod
+    def append(cls, fname, reader, startxref, objnum):
+        """ Appends an update to the pdf fname, which was written by a
+            PdfUpdateWriter for the same original (reader) before. If
+            writing fails, the pdf is truncated to its previous size.
+        """
+        return cls(fname, None, reader, startxref=startxref, objnum=objnum)
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self.is_append:
+            self.f.truncate(self.start)
+        super(PdfUpdateWriter, self).__exit__(exc_type, exc_value, traceback)
+
+
+    @staticmethod
+    def is_supported(data, reader):
+        """ Only unencrypted originals with a cross-reference table can be
+            updated. Objects in object streams (cross-reference streams)
+            can not be referenced from a table.
+        """
+        if reader.Encrypt is not None or reader.Size is None:
+            return False
+        startxref = get_startxref(data)
+        return startxref is not None and data[startxref:startxref + 4] == b"xref"
+
+
+    def reserve(self, pages):
+        """ Pages of the original are always replaced in place.
+        """
+        pass
+
+
+    def addpage(self, page, original=None):
+        """ Replaces original by page. Adding a page of the original
+            without replacement does nothing as it is already part of
+            the original.
+        """
+        if original is None and self._get_key(page) is not None:
+            return
+
+        key = self._get_key(original) if original is not None else None
+        if key is None:
+            raise PdfOutputError("Only pages of the original pdf can be replaced")
+        if page.Type != PdfName.Page:
+            raise PdfOutputError("Bad /Type:  Expected %s, found %s"
+                                 % (PdfName.Page, page.Type))
+
+        inheritable = page.inheritable
+        new_page = IndirectPdfDict(
+            page,
+            Resources=inheritable.Resources,
+            MediaBox=inheritable.MediaBox,
+            CropBox=inheritable.CropBox,
+            Rotate=inheritable.Rotate,
+        )
+        new_page.Parent = original.Parent
+        self._write_obj(key, new_page)
+
+
+    def close(self):
+        if self.closed:
+            return
+
+        # Without replaced pages only the original is written, a
+        # cross-reference section needs at least one subsection
+        if not self.offsets:
+            self._close_file()
+            return
+
+        # One subsection per range of consecutive object numbers
+        xref_offset = self.offset
+        self._write("xref\n")
+        keys = sorted(self.offsets)
+        start = 0
+        for i in range(1, len(keys) + 1):
+            if i < len(keys) and keys[i][0] == keys[i - 1][0] + 1:
+                continue
+            self._write("%d %d\n" % (keys[start][0], i - start))
+            for objnum, gennum in keys[start:i]:
+                self._write("%010d %05d n\r\n" % (self.offsets[(objnum, gennum)], gennum))
+            start = i
+
+        trailer = PdfDict(
+            Size=PdfObject(self.objnum + 1),
+            Root=self.reader.Root,
+            Info=self.reader.Info,
+            ID=self.reader.ID,
+            Prev=PdfObject(self.startxref))
+        self._write("trailer\n\n%s\nstartxref\n%s\n%%%%EOF\n" % (
+            self._format(trailer, []), xref_offset))
+        self.startxref = xref_offset
+        self._close_file()
+
+
+    #
+    # HELPER
+    #
+    def _get_key(self, obj):
+        """ Returns (objnum, gennum) if obj is an object of the original.
+        """
+        key = getattr(obj, "indirect", None)
+        if isinstance(key, tuple) and self.reader.indirect_objects.get(key) is obj:
+            return key
+        return None
+
+
+    def _write_raw_obj(self, key, formatted):
+        objnum, gennum = key if isinstance(key, tuple) else (key, 0)
+        self.offsets[(objnum, gennum)] = self.offset
+        self._write("%s %s obj\n%s\nendobj\n" % (objnum, gennum, formatted))
+
+
+    def _add(self, obj, pending):
+        key = self._get_key(obj)
+        if key is not None:
+            return "%s %s R" % key
+        return super(PdfUpdateWriter, self)._add(obj, pending)
+
+
+def get_startxref(data):
+    """ Returns the offset of the last cross-reference section of the pdf
+        data or None if it is not found.
+    """
+    pos = data.rfind(b"startxref", max(0, len(data) - 1024))
+    if pos < 0:
+        return None
+    value = data[pos + len(b"startxref"):].split()
+    if not value or not value[0].isdigit():
+        return None
+    return int(value[0])
+
+
+def _format_array(items, formatter):
+    """ Same line breaking as pdfrw.PdfWriter
+    """
+    if sum([len(x) for x in items]) <= 70:
+        return formatter % " ".join(items)
+
+    lines = []
+    count = 1000000
+    for x in items:
+        length = len(x) + 1
+        count += length
+        if count > 71:
+            line = []
+            lines.append(line)
+            count = length
+        line.append(x)
+    return formatter % "\n  ".join([" ".join(x) for x in lines])
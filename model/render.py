@@ -1,17 +1,54 @@
+import collections
+import contextlib
+import hashlib
 import io
+import itertools
 import json
+import multiprocessing
 import os
 import os.path
 import re
-import struct
-
-from pdfrw import PdfReader, PdfWriter, PageMerge
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, workers are not limited in memory
+    resource = None
+
+import numpy as np
+from PIL import Image, ImageDraw
+from pdfrw import PdfReader, PdfDict, PageMerge
 from reportlab.lib import colors
 from reportlab.pdfgen import canvas
 
+from model import lines
+from model.files import DiskFiles, MemoryFiles
+from model.pdf_reader import LazyPdfReader
+from model.pdf_writer import PdfStreamWriter, PdfUpdateWriter
+from utils.cache import DiskCache
+from utils.helper import Singleton
+import utils.config as cfg
+
 # Size
 DEFAULT_IMAGE_WIDTH = 1404
 DEFAULT_IMAGE_HEIGHT = 1872
+DEFAULT_THUMBNAIL_WIDTH = 156
+
+# Increase if thumbnails (see thumbnail) are drawn differently
+THUMBNAIL_CACHE_VERSION = 1
+
+# Increase if the rendering changes such that stored overlays of the
+# render manifest (see _render_pages) must be rendered again
+RENDER_MANIFEST_VERSION = 3
+
+# Templates (by png file) shared by all notebooks, see _get_template
+_templates = {}
+_templates_lock = threading.Lock()
 
 # Mappings
 default_stroke_color = {
@@ -26,6 +63,164 @@ default_stroke_color = {
 }
 
 
+class ThumbnailCache(DiskCache, metaclass=Singleton):
+    """ Persistent cache of page thumbnails (png), keyed by the content
+        hash of the page and the size of the thumbnail.
+    """
+
+    def __init__(self):
+        max_size = cfg.get("cache.thumbnails_max_size_mb", 64) * 1024 * 1024
+        super(ThumbnailCache, self).__init__(Path(cfg.CACHE_PATH) / "thumbnails", max_size)
+
+
+class RenderError(Exception):
+    """ Raised if a render job failed in a worker process.
+    """
+    pass
+
+
+class RenderService(metaclass=Singleton):
+    """ Persistent pool of render worker processes (render.workers). The
+        workers are started once and stay alive between documents, so
+        imports and caches are warm. A crash or a hanging job does not
+        affect the caller: the job fails with a RenderError and the workers
+        are restarted. Jobs are limited to render.timeout seconds per page
+        and workers to render.worker_memory_mb (not on Windows).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pool = None
+        self.workers = 0
+        self.restarts = 0
+        self.job_ids = itertools.count()
+        self.start_times = {}
+
+
+    def start(self):
+        """ Start all workers now instead of on the first job.
+        """
+        pool = self._get_pool()
+        return [pool.submit(os.getpid) for _ in range(self.workers)]
+
+
+    def submit(self, fn, *args):
+        pool = self._get_pool()
+        job_id = next(self.job_ids)
+        future = pool.submit(_run_render_job, job_id, fn, *args)
+
+        # Only the workers that ran the job are restarted if it fails
+        future.pool = pool
+        future.job_id = job_id
+        return future
+
+
+    def result(self, future, timeout):
+        """ Returns the result of the job or raises a RenderError. The
+            timeout starts as soon as a worker starts the job. Jobs that
+            wait for a worker are already "running" for the pool, so the
+            workers report when they start a job.
+        """
+        try:
+            while True:
+                try:
+                    return future.result(timeout=0.1)
+                except FutureTimeoutError:
+                    pass
+                except BrokenProcessPool:
+                    self._restart(future.pool)
+                    raise RenderError("Render worker crashed")
+                except Exception as e:
+                    raise RenderError("Render job failed: %s" % repr(e))
+
+                start_time = self._get_start_time(future)
+                if start_time is not None and time.perf_counter() - start_time > timeout:
+                    self._restart(future.pool)
+                    raise RenderError("Render job timed out after %ds" % timeout)
+        finally:
+            with self.lock:
+                self.start_times.pop(future.job_id, None)
+
+
+    #
+    # HELPER
+    #
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.workers = max(1, cfg.get("render.workers", 1))
+                max_memory = cfg.get("render.worker_memory_mb", 2048)
+
+                # Spawn (not fork) as the gui and sync threads are running
+                # Workers report the jobs they start (see _run_render_job)
+                context = multiprocessing.get_context("spawn")
+                started = context.SimpleQueue()
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=_init_render_worker,
+                    initargs=(max_memory, started))
+                self.pool.started = started
+            return self.pool
+
+
+    def _get_start_time(self, future):
+        """ Returns the time at which a worker started the job or None.
+        """
+        with self.lock:
+            started = future.pool.started
+            while not started.empty():
+                self.start_times[started.get()] = time.perf_counter()
+            return self.start_times.get(future.job_id)
+
+
+    def _restart(self, pool):
+        """ Stop all workers of pool; new workers are started for the
+            next job. Other jobs of the old workers fail with
+            BrokenProcessPool.
+        """
+        with self.lock:
+            if self.pool is not pool:
+                return
+            self.pool = None
+            self.restarts += 1
+
+        # ProcessPoolExecutor can not stop a running job, so we stop its
+        # workers
+        for process in list(getattr(pool, "_processes", {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False)
+
+
+_started_jobs = None
+
+
+def _run_render_job(job_id, fn, *args):
+    _started_jobs.put(job_id)
+    return fn(*args)
+
+
+def _init_render_worker(max_memory, started_jobs):
+    global _started_jobs
+    _started_jobs = started_jobs
+
+    if resource is None or not max_memory:
+        return
+
+    # Only the soft limit is set as the hard limit can not be raised
+    # again (e.g. if set by ulimit -v or a container)
+    limit = max_memory * 1024 * 1024
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+    if hard_limit != resource.RLIM_INFINITY:
+        limit = min(limit, hard_limit)
+
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard_limit))
+    except (ValueError, OSError) as e:
+        print("(Warning) Failed to limit the memory of the render worker")
+        print(e)
+
+
 class PDFPageLayout:
     def __init__(self, pdf_page=None, is_landscape=False, default_layout=None):
         if not pdf_page:
@@ -71,133 +266,328 @@ class PDFPageLayout:
             return "PDFPageLayout: None"
 
 
-def pdf(rm_files_path, path_highlighter, pages, path_original_pdf, path_annotated_pdf, path_oap_pdf):
+def pdf(rm_files_path, path_highlighter, pages, path_original_pdf, path_annotated_pdf, path_oap_pdf, path_render=None, files=None, isolate=False):
     """ Render pdf with annotations. The path_oap_pdf defines the pdf
-        which includes only annotated pages.
+        which includes only annotated pages; if it is None, it can be
+        rendered later on with oap. If path_render is given, pages
+        that did not change since the last rendering are reused from the
+        render manifest in this folder. Input files are read with files
+        (e.g. ZipFiles, default from disk) and the output pdfs can be
+        paths or binary file objects. If isolate is True, pages are
+        rendered in worker processes (see RenderService) and pages that
+        fail are not annotated. Returns the render stats (see
+        _new_render_stats).
     """
-
-    base_pdf = PdfReader(open(path_original_pdf, "rb"))
-
-    # Parse remarkable files and write into pdf
-    annotations_pdf = []
-    offsets = []
-
-    for page_nr in range(base_pdf.numPages):
-        rm_file_name = "%s/%d" % (rm_files_path, page_nr)
-        rm_file = "%s.rm" % rm_file_name
-        if not os.path.exists(rm_file):
-            annotations_pdf.append(None)
-            offsets.append(None)
-            continue
-
+    files = DiskFiles() if files is None else files
+    data = files.read(path_original_pdf)
+    base_pdf = LazyPdfReader(io.BytesIO(data))
+
+    # Collect all pages that are annotated
+    tolerance = cfg.get("render.simplify_tolerance", 0)
+    jobs = [None] * base_pdf.numPages
+    for page_nr, rm_file_name in _get_annotated_pages(rm_files_path, pages, base_pdf.numPages, files):
         if hasattr(base_pdf, "Root") and hasattr(base_pdf.Root, "Pages") and hasattr(base_pdf.Root.Pages, "MediaBox"):
             default_layout = base_pdf.Root.Pages.MediaBox
         else:
             default_layout = None
         page_layout = PDFPageLayout(base_pdf.pages[page_nr], default_layout=default_layout)
         if page_layout.layout is None:
-            annotations_pdf.append(None)
-            offsets.append(None)
             continue
 
         page_file = os.path.join(path_highlighter, f"{pages[page_nr]}.json")
-        annotated_page, offset = _render_rm_file(
-            rm_file_name,
-            page_layout=page_layout,
-            page_file=page_file,)
+        jobs[page_nr] = (rm_file_name, page_layout, page_file, files, tolerance)
+
+    # Parse remarkable files and merge them page by page with the
+    # original pdf such that only a few pages are in memory at once.
+    # If possible, the annotated pdf is an incremental update of the
+    # original such that pages without annotations are not touched. An
+    # annotated pdf of the last rendering is updated again, so only pages
+    # whose overlay changed are appended to it.
+    stats = _new_render_stats()
+    original_key = "%d:%s" % (len(data), hashlib.sha1(data[-65536:]).hexdigest())
+    is_update = PdfUpdateWriter.is_supported(data, base_pdf)
+    written = _load_annotated_pdf_state(path_render, path_annotated_pdf, original_key) if is_update else None
+    if written is not None:
+        writer_full = PdfUpdateWriter.append(path_annotated_pdf, base_pdf, written["startxref"], written["objnum"])
+    elif is_update:
+        writer_full = PdfUpdateWriter(path_annotated_pdf, data, base_pdf)
+    else:
+        writer_full = PdfStreamWriter(path_annotated_pdf)
+        writer_full.reserve(base_pdf.pages)
+    del data  # pdfrw keeps its own copy
+
+    overlay_ids = {}
+    writer_oap = None if path_oap_pdf is None else PdfStreamWriter(path_oap_pdf)
+    with writer_full, writer_oap or contextlib.nullcontext():
+        for i, rendered in enumerate(_render_pages(jobs, path_render, stats, isolate)):
+            annotations_page, offset, overlay_id = (None, None, None) if rendered is None else rendered
+            if overlay_id is not None:
+                overlay_ids[str(i)] = overlay_id
+
+            # Pages that are already part of the annotated pdf. Pages that
+            # are not annotated are not even loaded.
+            if written is not None:
+                is_written = written["pages"].get(str(i)) == overlay_id
+            else:
+                is_written = is_update and annotations_page is None
+            if is_written and (annotations_page is None or writer_oap is None):
+                continue
 
-        if len(annotated_page.pages) <= 0:
-            annotations_pdf.append(None)
-        else:
-            page = annotated_page.pages[0]
-            annotations_pdf.append(page)
-        offsets.append(offset)
-
-    # Merge annotations pdf and original pdf
-    writer_full = PdfWriter()
-    writer_oap = PdfWriter()
-    for i in range(base_pdf.numPages):
-        annotations_page = annotations_pdf[i]
-
-        if annotations_page is not None:
-            # The annotations page is at least as large as the base PDF page,
-            # so we merge the base PDF page under the annotations page.
-            merger = PageMerge(annotations_page)
-            pdf = merger.add(base_pdf.pages[i], prepend=True)[0]
-            pdf.x -= offsets[i][0]
-            pdf.y -= offsets[i][1]
-            merger.render()
-            writer_oap.addpage(annotations_page)
-            writer_full.addpage(annotations_page)
-        else:
-            writer_full.addpage(base_pdf.pages[i])
+            start_time = time.perf_counter()
+            base_page = base_pdf.pages[i]
+            if annotations_page is not None:
+                _merge_page(annotations_page, base_page, offset)
+                merge_time = time.perf_counter()
+                if writer_oap is not None:
+                    writer_oap.addpage(annotations_page)
+                if not is_written:
+                    writer_full.addpage(annotations_page, original=base_page)
+            else:
+                # Annotations of this page were removed
+                merge_time = time.perf_counter()
+                writer_full.addpage(base_page, original=base_page if written is not None else None)
+
+            stats["merge_time"] += merge_time - start_time
+            stats["write_time"] += time.perf_counter() - merge_time
+        start_time = time.perf_counter()
+    stats["write_time"] += time.perf_counter() - start_time
+
+    if path_render is not None:
+        state = None
+        if is_update and isinstance(path_annotated_pdf, (str, os.PathLike)):
+            state = {
+                "original": original_key,
+                "size": writer_full.offset,
+                "full_size": writer_full.offset if written is None else written["full_size"],
+                "startxref": writer_full.startxref,
+                "objnum": writer_full.objnum,
+                "pages": overlay_ids,
+            }
+        manifest = _load_render_manifest(path_render)
+        manifest["annotated"] = state
+        _save_render_manifest(path_render, manifest)
+
+    _print_render_stats(path_annotated_pdf, stats)
+    return stats
+
+
+def oap(path_render, path_original_pdf, path_oap_pdf):
+    """ Render the pdf which includes only the annotated pages from the
+        overlays in the render manifest of the last pdf rendering (see
+        pdf with path_render). The pdf is only written again if the
+        manifest changed. Returns path_oap_pdf or None if no page is
+        annotated.
+    """
+    manifest = _load_render_manifest(path_render)
+    pages = sorted(manifest["pages"].values(), key=lambda page: page["page"])
+    if not pages:
+        return None
+
+    # Keyed by the manifest (without this key) and the original pdf
+    original = os.stat(path_original_pdf)
+    state = {name: value for name, value in manifest.items() if name != "oap"}
+    key = json.dumps([state, original.st_size, original.st_mtime_ns], sort_keys=True)
+    key = hashlib.sha1(key.encode()).hexdigest()
+    if manifest.get("oap") == key and os.path.exists(path_oap_pdf):
+        return path_oap_pdf
+
+    base_pdf = LazyPdfReader(path_original_pdf)
+    overlays = {}
+    overlay_pages = collections.Counter(page["file"] for page in pages)
+    with PdfStreamWriter(path_oap_pdf) as writer:
+        for page in pages:
+            if page["file"] not in overlays:
+                overlays[page["file"]] = PdfReader(os.path.join(path_render, page["file"]))
+            annotations_page = overlays[page["file"]].pages[page["index"]]
+
+            overlay_pages[page["file"]] -= 1
+            if overlay_pages[page["file"]] <= 0:
+                del overlays[page["file"]]
+
+            _merge_page(annotations_page, base_pdf.pages[page["page"]], page["offset"])
+            writer.addpage(annotations_page)
+
+    manifest["oap"] = key
+    _save_render_manifest(path_render, manifest)
+    return path_oap_pdf
+
+
+def _load_annotated_pdf_state(path_render, path_annotated_pdf, original_key):
+    """ Returns the state of the annotated pdf of the last rendering
+        (see pdf) if it can be updated, otherwise None. If the updates
+        are larger than the first annotated pdf, it is written again.
+    """
+    if path_render is None or not isinstance(path_annotated_pdf, (str, os.PathLike)):
+        return None
+
+    state = _load_render_manifest(path_render).get("annotated")
+    try:
+        size = os.path.getsize(path_annotated_pdf)
+    except OSError:
+        return None
 
-    writer_full.write(path_annotated_pdf)
-    writer_oap.write(path_oap_pdf)
+    if state is None or state["original"] != original_key or state["size"] != size:
+        return None
+    if size > 2 * state["full_size"]:
+        return None
+    return state
 
 
-def notebook(path, uuid, path_annotated_pdf, is_landscape, path_templates=None):
+def _merge_page(annotations_page, base_page, offset):
+    """ The annotations page is at least as large as the base PDF page,
+        so we merge the base PDF page under the annotations page.
+    """
+    merger = PageMerge(annotations_page)
+    pdf = merger.add(base_page, prepend=True)[0]
+    pdf.x -= offset[0]
+    pdf.y -= offset[1]
+    merger.render()
+
+
+def _get_annotated_pages(rm_files_path, pages, num_pages, files):
+    """ Returns (page_nr, rm_file_name) of all annotated pages, sorted
+        by page number. The .rm files are found by listing rm_files_path
+        once and are named by page number or by page id (see .content).
+    """
+    page_nrs = {page_id: page_nr for page_nr, page_id in enumerate(pages or [])}
+    annotated = {}
+    for name in files.listdir(rm_files_path):
+        stem, ext = os.path.splitext(name)
+        if ext != ".rm":
+            continue
+
+        page_nr = int(stem) if stem.isdigit() else page_nrs.get(stem)
+        if page_nr is not None and page_nr < num_pages:
+            annotated[page_nr] = "%s/%s" % (rm_files_path, stem)
+    return sorted(annotated.items())
+
+
+def notebook(path, uuid, path_annotated_pdf, is_landscape, path_templates=None, path_render=None, files=None, isolate=False):
+    """ Render the pages of a notebook on top of their templates. Input
+        and output files are handled as in pdf. Returns the render stats
+        (see _new_render_stats).
+    """
+    files = DiskFiles() if files is None else files
     rm_files_path = "%s/%s" % (path, uuid)
-    annotations_pdf = []
+    page_layout = PDFPageLayout(is_landscape=is_landscape)
+    tolerance = cfg.get("render.simplify_tolerance", 0)
 
+    jobs = []
     p = 0
     while True:
         rm_file_name = "%s/%d" % (rm_files_path, p)
         rm_file = "%s.rm" % rm_file_name
 
-        if not os.path.exists(rm_file):
+        if not files.exists(rm_file):
             break
 
-        overlay, _ = _render_rm_file(rm_file_name, PDFPageLayout(is_landscape=is_landscape))
-        annotations_pdf.append(overlay)
+        jobs.append((rm_file_name, page_layout, None, files, tolerance))
         p += 1
 
-    # Write empty notebook notes containing blank pages or templates
-    writer = PdfWriter()
-    templates = _get_templates_per_page(path, uuid, path_templates)
-    for template in templates:
-        if template is None:
-            writer.addpage(_blank_page())
-        else:
-            writer.addpage(template.pages[0])
-    writer.write(path_annotated_pdf)
-
-    # Overlay empty notebook with annotations
-    templates_pdf = PdfReader(path_annotated_pdf)
-    for i in range(len(annotations_pdf)):
-        templates_pdf.pages[i].Rotate = 90 if is_landscape else 0
-        is_empty_page = len(annotations_pdf[i].pages) <= 0
-        if is_empty_page:
-            continue
+    # Notebook pages are blank pages or templates which are overlayed
+    # with the annotations and written page by page
+    templates = _get_templates_per_page(path, uuid, path_templates, files)
+    jobs = jobs[:len(templates)]
+    stats = _new_render_stats()
+    overlays = _render_pages(jobs, path_render, stats, isolate)
+    with PdfStreamWriter(path_annotated_pdf) as writer:
+        for i, template in enumerate(templates):
+            rendered = next(overlays) if i < len(jobs) else None
+
+            start_time = time.perf_counter()
+            page = _blank_page() if template is None else _template_page(template)
+            if rendered is not None:
+                page.Rotate = 90 if is_landscape else 0
+                annotated_page, _, _ = rendered
+                annotated_page.Rotate = -90 if is_landscape else 0
+                merger = PageMerge(page)
+                merger.add(annotated_page).render()
+
+            merge_time = time.perf_counter()
+            writer.addpage(page)
+            stats["merge_time"] += merge_time - start_time
+            stats["write_time"] += time.perf_counter() - merge_time
+        start_time = time.perf_counter()
+    stats["write_time"] += time.perf_counter() - start_time
+
+    # Finish rendering i.e. update the render manifest
+    for _ in overlays:
+        pass
+
+    _print_render_stats(path_annotated_pdf, stats)
+    return stats
+
+
+def _get_templates_per_page(path, uuid, path_templates, files):
+    pagedata_file = "%s/%s.pagedata" % (path, uuid)
+    pagedata = files.read(pagedata_file).decode("utf-8")
+    template_paths = ["%s/%s.png" % (path_templates, l) for l in pagedata.splitlines()]
 
-        annotated_page = annotations_pdf[i].pages[0]
-        annotated_page.Rotate = -90 if is_landscape else 0
-        merger = PageMerge(templates_pdf.pages[i])
-        merger.add(annotated_page).render()
+    return [_get_template(template_path) for template_path in template_paths]
 
-    writer = PdfWriter()
-    writer.write(path_annotated_pdf, templates_pdf)
 
+def _get_template(template_path):
+    """ Returns the pdf of the given template png or None if it does not
+        exist. The pdf is created only once, stored in the .remapy folder
+        next to the templates and shared by all pages and notebooks.
+    """
+    try:
+        stat = os.stat(template_path)
+    except OSError:
+        return None
+
+    key = (template_path, stat.st_mtime_ns, stat.st_size)
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is None:
+            template = PdfReader(io.BytesIO(_load_template_pdf(template_path, stat.st_mtime)))
+            template.read_all()
+            _templates[key] = template
 
-def _get_templates_per_page(path, uuid, path_templates):
-    pagedata_file = "%s/%s.pagedata" % (path, uuid)
-    with open(pagedata_file, 'r') as f:
-        template_paths = ["%s/%s.png" % (path_templates, l.rstrip('\n')) for l in f]
+    return template
 
-    templates = []
-    for template_path in template_paths:
-        if not os.path.exists(template_path):
-            templates.append(None)
-            continue
 
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=(DEFAULT_IMAGE_WIDTH, DEFAULT_IMAGE_HEIGHT))
-        can.drawImage(template_path, 0, 0)
-        can.save()
-        packet.seek(0)
-        templates.append(PdfReader(packet))
+def _load_template_pdf(template_path, mtime):
+    folder, file_name = os.path.split(template_path)
+    path_template_pdf = os.path.join(folder, ".remapy", "%s.pdf" % os.path.splitext(file_name)[0])
+
+    if os.path.exists(path_template_pdf) and os.path.getmtime(path_template_pdf) >= mtime:
+        with open(path_template_pdf, "rb") as f:
+            return f.read()
 
-    return templates
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=(DEFAULT_IMAGE_WIDTH, DEFAULT_IMAGE_HEIGHT))
+    can.drawImage(template_path, 0, 0)
+    can.save()
+    data = packet.getvalue()
+
+    # The templates folder could be read only, so this is optional
+    try:
+        Path(path_template_pdf).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (path_template_pdf, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path_template_pdf)
+    except OSError:
+        pass
+
+    return data
+
+
+def _template_page(template):
+    """ Returns a copy of the template page that can be merged with
+        annotations without changing the shared template. The contents and
+        the image are still the same objects and are therefore written
+        only once per notebook.
+    """
+    template_page = template.pages[0]
+    page = PdfDict(template_page)
+
+    resources = PdfDict(template_page.inheritable.Resources)
+    if resources.XObject is not None:
+        resources.XObject = PdfDict(resources.XObject)
+    page.Resources = resources
+    return page
 
 
 def _blank_page(width=DEFAULT_IMAGE_WIDTH, height=DEFAULT_IMAGE_HEIGHT):
@@ -207,255 +597,792 @@ def _blank_page(width=DEFAULT_IMAGE_WIDTH, height=DEFAULT_IMAGE_HEIGHT):
     return blank
 
 
-def _render_rm_file(rm_file_name, page_layout=None, page_file=None):
-    """ Render the .rm files (old .lines). See also
-    https://plasma.ninja/blog/devices/remarkable/binary/format/2017/12/26/reMarkable-lines-file-format.html
+def _render_pages(jobs, path_render=None, stats=None, isolate=False):
+    """ Render all given jobs (see _render_rm_files) and yield the overlay
+        page (pdfrw), its offset and the id of the overlay (or None
+        without path_render) for every job, or None if the job is None or
+        failed. If path_render is given the overlays of pages
+        whose sources did not change are loaded from the render manifest
+        in path_render. All other pages are rendered and stored in the
+        manifest.
     """
+    manifest = {"pages": {}} if path_render is None else _load_render_manifest(path_render)
+    todo = [None] * len(jobs)
+    pages = {}
+    for i, job in enumerate(jobs):
+        if job is None:
+            continue
 
-    rm_file = "%s.rm" % rm_file_name
-    rm_file_metadata = "%s-metadata.json" % rm_file_name
+        if path_render is None:
+            todo[i] = job
+            continue
 
-    # Is this a reMarkable .lines file?
-    with open(rm_file, 'rb') as f:
-        data = f.read()
-    offset = 0
-    expected_header_v3 = b'reMarkable .lines file, version=3          '
-    expected_header_v5 = b'reMarkable .lines file, version=5          '
-    if len(data) < len(expected_header_v5) + 4:
-        print('File too short to be a valid file')
-        os.abort()
-
-    fmt = '<{}sI'.format(len(expected_header_v5))
-    header, nlayers = struct.unpack_from(fmt, data, offset)
-    offset += struct.calcsize(fmt)
-    is_v3 = (header == expected_header_v3)
-    is_v5 = (header == expected_header_v5)
-    if (not is_v3 and not is_v5) or nlayers < 1:
-        print('Not a valid reMarkable file: <header={}><nlayers={}>'.format(header, nlayers))
-        os.abort()
-
-
-    # Load name of layers; if layer name starts with # we use this color
-    # for this layer
-    layer_colors = [None for _ in range(nlayers)]
-    if os.path.exists(rm_file_metadata):
-        with open(rm_file_metadata, "r") as meta_file:
-            layers = json.loads(meta_file.read())["layers"]
+        key = os.path.basename(job[0])
+        sources = _get_page_sources(*job)
+        page = manifest["pages"].get(key)
+        is_unchanged = page is not None and page["sources"] == sources and \
+            os.path.exists(os.path.join(path_render, page["file"]))
 
-        for l in range(len(layers)):
-            layer = layers[l]
+        if is_unchanged:
+            pages[key] = page
+        else:
+            pages[key] = {"sources": sources}
+            todo[i] = job
+        pages[key]["page"] = i
+
+    if path_render is not None:
+        Path(path_render).mkdir(parents=True, exist_ok=True)
+
+    # Overlays of unchanged pages are read once per file and released
+    # after the last page of the file was used
+    stored = {}
+    stored_pages = collections.Counter(
+        pages[os.path.basename(job[0])]["file"] for job, todo_job in zip(jobs, todo)
+        if job is not None and todo_job is None)
+
+    batches = _render_rm_files(todo, stats, isolate)
+    rendered = collections.deque()
+    for job, todo_job in zip(jobs, todo):
+        if job is None:
+            yield None
+            continue
 
-            matches = re.search(r"#([^\s]+)", layer["name"], re.M | re.I)
-            if not matches:
-                continue
-            color_code = matches[0].lower()
+        key = os.path.basename(job[0])
+        if todo_job is None:
+            page = pages[key]
+            if page["file"] not in stored:
+                stored[page["file"]] = PdfReader(os.path.join(path_render, page["file"]))
+            overlay = stored[page["file"]]
 
-            # Try to parse hex code
-            try:
-                has_alpha = len(color_code) > 7
-                layer_colors[l] = colors.HexColor(color_code, hasAlpha=has_alpha)
-                continue
-            except:
-                pass
-
-            # Try to get from name
-            color_code = color_code[1:]
-            color_names = colors.getAllNamedColors()
-            if color_code in color_names:
-                layer_colors[l] = color_names[color_code]
-
-            # No valid color found... automatic fallback to default
-
-    # Iterate through layers on the page (There is at least one) to collect annotation data to render
-    layer_data_list = []
-    all_x = [page_layout.x_start, page_layout.x_end]
-    all_y = [page_layout.y_start, page_layout.y_end]
-    for layer in range(nlayers):
-        fmt = '<I'
-        (strokes_count,) = struct.unpack_from(fmt, data, offset)
-        offset += struct.calcsize(fmt)
-
-        # Iterate through the strokes in the layer (If there is any)
-        highlighter_stroke_list = []
-        other_stroke_list = []
-        for stroke in range(strokes_count):
-            if is_v3:
-                fmt = '<IIIfI'
-                pen_nr, color, i_unk, width, segments_count = struct.unpack_from(fmt, data, offset)
-                offset += struct.calcsize(fmt)
-            if is_v5:
-                fmt = '<IIIffI'
-                pen_nr, color, i_unk, width, unknown, segments_count = struct.unpack_from(fmt, data, offset)
-                offset += struct.calcsize(fmt)
-
-            # Check which tool is used for both, v3 and v5 and set props
-            # https://support.remarkable.com/hc/en-us/articles/115004558545-5-1-Tools-Overview
-            is_highlighter = (pen_nr == 5 or pen_nr == 18)
-            is_eraser = pen_nr == 6
-            is_eraser_area = pen_nr == 8
-            is_sharp_pencil = (pen_nr == 7 or pen_nr == 13)
-            is_tilt_pencil = (pen_nr == 1 or pen_nr == 14)
-            is_marker = (pen_nr == 3 or pen_nr == 16)
-            is_ballpoint = (pen_nr == 2 or pen_nr == 15)
-            is_fineliner = (pen_nr == 4 or pen_nr == 17)
-            is_brush = (pen_nr == 0 or pen_nr == 12)
-            is_calligraphy = pen_nr == 21
-
-            if is_sharp_pencil or is_tilt_pencil:
-                pen = Mechanical_Pencil(page_layout.scale, width, color)
-            if is_brush:
-                pen = Brush(page_layout.scale, width, color)
-            elif is_ballpoint:
-                pen = Ballpoint(page_layout.scale, width, color)
-            elif is_fineliner:
-                pen = Fineliner(page_layout.scale, width, color)
-            elif is_marker:
-                pen = Marker(page_layout.scale, width, color)
-            elif is_calligraphy:
-                pen = Calligraphy(page_layout.scale, width, color)
-            elif is_highlighter:
-                pen = Highlighter(page_layout.scale, 30, color)
-            elif is_eraser:
-                pen = Eraser(page_layout.scale, width, color)
-            elif is_eraser_area:
-                pen = EraseArea(page_layout.scale, width, color)
-            elif is_tilt_pencil:
-                pen = Pencil(page_layout.scale, width, color)
-            elif is_sharp_pencil:
-                pen = Mechanical_Pencil(page_layout.scale, width, color)
+            stored_pages[page["file"]] -= 1
+            if stored_pages[page["file"]] <= 0:
+                del stored[page["file"]]
+
+            yield overlay.pages[page["index"]], tuple(page["offset"]), _get_overlay_id(page)
+            continue
+
+        if not rendered:
+            packet, offsets = next(batches)
+            if packet is None:
+                rendered.extend((None, None, None, None) for _ in offsets)
             else:
-                print('Unknown pen: {}'.format(pen_nr))
-                opacity = 0.
-
-            # Iterate through the segments to form a polyline
-            last_width = 0
-            segment_points = []
-            segment_widths = []
-            segment_opacities = []
-            segment_colors = []
-            for segment in range(segments_count):
-                fmt = '<ffffff'
-                x_pos, y_pos, speed, tilt, width, pressure = struct.unpack_from(fmt, data, offset)
-                offset += struct.calcsize(fmt)
-
-                if segment % pen.segment_length == 0:
-                    segment_color = pen.get_segment_color(speed, tilt, width, pressure, last_width)
-                    segment_width = pen.get_segment_width(speed, tilt, width, pressure, last_width)
-                    segment_opacity = pen.get_segment_opacity(speed, tilt, width, pressure, last_width)
-
-                segment_widths.append(segment_width)
-                segment_opacities.append(segment_opacity)
-                if layer_colors[layer] is None:
-                    segment_colors.append(segment_color)
-                else:
-                    segment_colors.append(layer_colors[layer])
+                overlay = PdfReader(io.BytesIO(packet))
+                overlay_file = None
+                if path_render is not None:
+                    overlay_file = "%s.pdf" % hashlib.sha1(packet).hexdigest()[:16]
+                    with open(os.path.join(path_render, overlay_file), "wb") as f:
+                        f.write(packet)
+                rendered.extend((overlay.pages[i], offset, overlay_file, i) for i, offset in enumerate(offsets))
+
+        overlay_page, offset, overlay_file, index = rendered.popleft()
+        if overlay_page is None:
+            # Not stored in the manifest, so it is rendered again next time
+            pages.pop(key, None)
+            yield None
+            continue
 
-                if page_layout.is_landscape:
-                    render_xpos = page_layout.x_end - page_layout.scale * y_pos
-                    render_ypos = page_layout.y_end - page_layout.scale * x_pos
-                else:
-                    render_xpos = page_layout.x_start + page_layout.scale * x_pos
-                    render_ypos = page_layout.y_end - page_layout.scale * y_pos
-                segment_points.extend([render_xpos, render_ypos])
-                last_width = segment_width
+        if path_render is None:
+            yield overlay_page, offset, None
+            continue
 
-            if is_eraser_area or is_eraser:
-                continue
+        pages[key].update(offset=list(offset), file=overlay_file, index=index)
+        yield overlay_page, offset, _get_overlay_id(pages[key])
 
-            stroke_data = {}
-            stroke_data["x_coordinates"] = segment_points[0::2]
-            stroke_data["y_coordinates"] = segment_points[1::2]
-            stroke_data["segment_widths"] = segment_widths
-            stroke_data["segment_opacities"] = segment_opacities
-            stroke_data["segment_colors"] = segment_colors
-            if is_highlighter:
-                highlighter_stroke_list.append(stroke_data)
-            else:
-                other_stroke_list.append(stroke_data)
-            all_x.extend(stroke_data["x_coordinates"])
-            all_y.extend(stroke_data["y_coordinates"])
+    if path_render is not None:
+        manifest["pages"] = pages
+        _save_render_manifest(path_render, manifest)
+
+
+def _get_overlay_id(page):
+    """ Overlays are stored by content hash, so the id of an overlay
+        changes whenever it is rendered differently.
+    """
+    return "%s:%d" % (page["file"], page["index"])
+
+
+def _get_page_sources(rm_file_name, page_layout, page_file, files=None, tolerance=0):
+    """ Hashes of all files (and the layout and simplify tolerance) an
+        overlay is rendered from.
+    """
+    files = DiskFiles() if files is None else files
+
+    def file_hash(path):
+        if path is None or not files.exists(path):
+            return None
+        return hashlib.sha1(files.read(path)).hexdigest()
+
+    return {
+        "rm": file_hash("%s.rm" % rm_file_name),
+        "metadata": file_hash("%s-metadata.json" % rm_file_name),
+        "highlights": file_hash(page_file),
+        "layout": page_layout.layout,
+        "simplify_tolerance": tolerance,
+    }
+
+
+def _load_render_manifest(path_render):
+    manifest_file = os.path.join(path_render, "manifest.json")
+    try:
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+        if manifest["version"] == RENDER_MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+
+    return {"version": RENDER_MANIFEST_VERSION, "pages": {}}
+
+
+def _save_render_manifest(path_render, manifest):
+    """ Besides the pages, the manifest contains the key of the pdf
+        rendered by oap ("oap") and the state of the annotated pdf
+        ("annotated", see pdf).
+    """
+    # Remove overlays that are not used by any page anymore
+    overlay_files = set(page["file"] for page in manifest["pages"].values())
+    for file_name in os.listdir(path_render):
+        if file_name.endswith(".pdf") and file_name not in overlay_files:
+            os.remove(os.path.join(path_render, file_name))
+
+    with open(os.path.join(path_render, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def _render_rm_files(jobs, stats=None, isolate=False):
+    """ Render all given (rm_file_name, page_layout, page_file, files,
+        tolerance) jobs that are not None in batches of render.batch_pages
+        pages and yield the pdf and the offsets of the pages of every batch
+        in order (see _render_rm_files_to_bytes). If isolate is True or
+        render.workers is larger than one, batches are rendered by the
+        RenderService. Pages that could not be rendered there are yielded
+        as (None, [None]). Only a few batches per worker are rendered
+        ahead, so memory does not grow with the number of pages. The
+        render stats of all pages are added to stats.
+    """
+    jobs = [job for job in jobs if job is not None]
+    workers = max(1, cfg.get("render.workers", 1))
+    service = RenderService() if isolate or (workers > 1 and len(jobs) > 1) else None
+
+    # Each worker should get at least one batch
+    batch_pages = max(1, cfg.get("render.batch_pages", 16))
+    if service is not None:
+        batch_pages = min(batch_pages, -(-len(jobs) // workers))
+    batches = [jobs[i:i + batch_pages] for i in range(0, len(jobs), batch_pages)]
+
+    if service is None:
+        for batch in batches:
+            yield _add_render_stats(stats, _render_rm_files_to_bytes(batch))
+        return
+
+    window = collections.deque()
+    try:
+        for batch in batches:
+            batch = [_get_portable_job(*job) for job in batch]
+            window.append((batch, service.submit(_render_rm_files_to_bytes, batch)))
+            if len(window) > 2 * workers:
+                for rendered in _get_rendered(service, *window.popleft()):
+                    yield _add_render_stats(stats, rendered)
+        while window:
+            for rendered in _get_rendered(service, *window.popleft()):
+                yield _add_render_stats(stats, rendered)
+    finally:
+        for _, future in window:
+            future.cancel()
+
+
+def _get_rendered(service, batch, future):
+    """ Yields the rendered batch. If the batch failed, its pages are
+        rendered again one by one such that only broken pages are missing.
+    """
+    timeout = cfg.get("render.timeout", 60) * len(batch)
+    try:
+        yield service.result(future, timeout)
+        return
+    except RenderError as e:
+        if len(batch) == 1:
+            print("(Warning) Failed to render %s: %s" % (batch[0][0], e))
+            yield None, [None], _new_render_stats()
+            return
+
+    for job in batch:
+        yield from _get_rendered(service, [job], service.submit(_render_rm_files_to_bytes, [job]))
+
+
+def _get_portable_job(rm_file_name, page_layout, page_file, files, tolerance):
+    """ Files on disk are read by the worker process, all other files of
+        the page are sent to the worker.
+    """
+    if type(files) is not DiskFiles:
+        paths = ["%s.rm" % rm_file_name, "%s-metadata.json" % rm_file_name, page_file]
+        files = MemoryFiles(files, paths)
+    return rm_file_name, page_layout, page_file, files, tolerance
+
+
+def _new_render_stats():
+    """ Number of points, number of drawn points (see _simplify_stroke),
+        size of all rendered overlays and the time spent (in seconds) to
+        parse .rm files, compute the widths and colors of the pens, draw
+        overlays, merge them into pages and write the pdf. Times of pages
+        rendered in worker processes are summed up.
+    """
+    return {
+        "points": 0,
+        "points_drawn": 0,
+        "bytes": 0,
+        "parse_time": 0.0,
+        "pen_time": 0.0,
+        "draw_time": 0.0,
+        "merge_time": 0.0,
+        "write_time": 0.0,
+    }
+
+
+def _add_render_stats(stats, rendered):
+    """ Adds the stats of rendered pages to stats and returns the
+        overlays and offsets of the pages.
+    """
+    packet, canvas_offsets, page_stats = rendered
+    if stats is not None:
+        for key, value in page_stats.items():
+            stats[key] += value
+    return packet, canvas_offsets
 
-        layer_data = {}
-        layer_data["highlighter_strokes"] = highlighter_stroke_list
-        layer_data["other_strokes"] = other_stroke_list
-        layer_data_list.append(layer_data)
+
+def _print_render_stats(path_pdf, stats):
+    """ Prints how many points the simplification of strokes (see
+        render.simplify_tolerance) dropped. The savings in size and time
+        are measured with the render benchmark (tests/render_benchmark.py).
+    """
+    dropped = stats["points"] - stats["points_drawn"]
+    if dropped <= 0 or stats["points_drawn"] <= 0:
+        return
+
+    print("Simplified strokes of %s: Drew %d of %d points (overlays: %.1f KB)" % (
+        os.path.basename(str(getattr(path_pdf, "name", path_pdf))), stats["points_drawn"], stats["points"],
+        stats["bytes"] / 1024))
+
+
+def _render_rm_files_to_bytes(jobs):
+    """ Render the .rm files (old .lines, see model.lines) of all
+        (rm_file_name, page_layout, page_file, files, tolerance) jobs into
+        a single pdf with one page per job, such that only one pdf must be
+        serialized and parsed for many pages. This runs in worker
+        processes too. Returns the pdf, the offset of every page and the
+        render stats (see _new_render_stats).
+    """
+    stats = _new_render_stats()
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet)
+    canvas_offsets = [_draw_rm_file(can, stats, *job) for job in jobs]
+
+    start_time = time.perf_counter()
+    can.save()
+    packet = packet.getvalue()
+    stats["draw_time"] += time.perf_counter() - start_time
+    stats["bytes"] = len(packet)
+    return packet, canvas_offsets, stats
+
+
+def _draw_rm_file(can, stats, rm_file_name, page_layout, page_file=None, files=None, tolerance=0):
+    """ Draw the .rm file as new page of the canvas. The page is as large as
+        the page layout and all strokes. Strokes are simplified if the
+        tolerance (render.simplify_tolerance) is larger than 0. Returns the
+        offset of the page.
+    """
+    files = DiskFiles() if files is None else files
+    page = _load_page(rm_file_name, page_layout, files, stats)
+    points = sum(len(stroke) for stroke in page.strokes())
+    stats["points"] += points
+
+    # Drop points that are within the tolerance if simplification is enabled
+    start_time = time.perf_counter()
+    if tolerance > 0:
+        for layer in page.layers:
+            layer.strokes = [_simplify_stroke(stroke, tolerance) for stroke in layer.strokes]
+        stats["points_drawn"] += sum(len(stroke) for stroke in page.strokes())
+    else:
+        stats["points_drawn"] += points
 
     # Preprocess collected data to determine canvas size and offset
-    min_x = min(all_x)
-    max_x = max(all_x)
-    min_y = min(all_y)
-    max_y = max(all_y)
+    min_x, min_y, max_x, max_y = page.get_bounds()
     canvas_width = max_x - min_x
     canvas_height = max_y - min_y
     canvas_offset = (min_x, min_y)
-    packet = io.BytesIO()
-    can = canvas.Canvas(packet, pagesize=(canvas_width, canvas_height))
+    can.setPageSize((canvas_width, canvas_height))
     can.translate(-canvas_offset[0], -canvas_offset[1])
 
     # Special handling to plot snapped highlights
-    if(page_file and os.path.exists(page_file)):
-        with open(page_file, "r") as f:
-            highlights = json.loads(f.read())["highlights"]
-            for h in highlights[0]:
-                c = h["color"] if "color" in h else 3
-                can.setStrokeColor(default_stroke_color[c])
-                can.setStrokeAlpha(0.3)
-
-                p = can.beginPath()
-                for rects in h["rects"]:
-                    if page_layout.is_landscape:
-                        render_xpos = page_layout.x_end - page_layout.scale * rects["y"]
-                        render_ypos = page_layout.y_end - page_layout.scale * rects["x"]
-                        width = rects["height"] * page_layout.scale
-                        height = rects["width"] * page_layout.scale
-                        render_xpos -= width
-                        render_ypos -= height / 2
-                    else:
-                        render_xpos = page_layout.x_start + page_layout.scale * rects["x"]
-                        render_ypos = page_layout.y_end - page_layout.scale * rects["y"]
-                        width = rects["width"] * page_layout.scale
-                        height = rects["height"] * page_layout.scale
-                        render_ypos -= height / 2
-
-                    can.setLineWidth(height)
-
-                    p.moveTo(render_xpos, render_ypos)
-                    p.lineTo(render_xpos+width, render_ypos)
-                p.close()
-                can.drawPath(p)
+    if page_file and files.exists(page_file):
+        highlights = json.loads(files.read(page_file))["highlights"]
+        for h in highlights[0]:
+            c = h["color"] if "color" in h else 3
+            can.setStrokeColor(default_stroke_color[c])
+            can.setStrokeAlpha(0.3)
+
+            p = can.beginPath()
+            for rects in h["rects"]:
+                if page_layout.is_landscape:
+                    render_xpos = page_layout.x_end - page_layout.scale * rects["y"]
+                    render_ypos = page_layout.y_end - page_layout.scale * rects["x"]
+                    width = rects["height"] * page_layout.scale
+                    height = rects["width"] * page_layout.scale
+                    render_xpos -= width
+                    render_ypos -= height / 2
+                else:
+                    render_xpos = page_layout.x_start + page_layout.scale * rects["x"]
+                    render_ypos = page_layout.y_end - page_layout.scale * rects["y"]
+                    width = rects["width"] * page_layout.scale
+                    height = rects["height"] * page_layout.scale
+                    render_ypos -= height / 2
+
+                can.setLineWidth(height)
+
+                p.moveTo(render_xpos, render_ypos)
+                p.lineTo(render_xpos+width, render_ypos)
+            p.close()
+            can.drawPath(p)
 
     # Iterate over collected data to draw annotations
-    for layer in layer_data_list:
-        for stroke in layer["highlighter_strokes"]:
-            can.setLineCap(1)
-            for i in range(1, len(stroke["x_coordinates"])):
-                can.setStrokeColor(stroke["segment_colors"][i])
-                can.setLineWidth(stroke["segment_widths"][i])
-                can.setStrokeAlpha(0.1)
-                p = can.beginPath()
-                p.moveTo(stroke["x_coordinates"][i-1], stroke["y_coordinates"][i-1])
-                p.lineTo(stroke["x_coordinates"][i], stroke["y_coordinates"][i])
-                p.moveTo(stroke["x_coordinates"][i], stroke["y_coordinates"][i])
-                p.close()
-                can.drawPath(p)
-        for stroke in layer["other_strokes"]:
-            can.setLineCap(1)
-            for i in range(1, len(stroke["x_coordinates"])):
-                can.setStrokeColor(stroke["segment_colors"][i])
-                can.setLineWidth(stroke["segment_widths"][i])
-                can.setStrokeAlpha(stroke["segment_opacities"][i])
-                p = can.beginPath()
-                p.moveTo(stroke["x_coordinates"][i-1], stroke["y_coordinates"][i-1])
-                p.lineTo(stroke["x_coordinates"][i], stroke["y_coordinates"][i])
-                p.moveTo(stroke["x_coordinates"][i], stroke["y_coordinates"][i])
-                p.close()
-                can.drawPath(p)
+    can.setLineCap(1)
+    can.setLineJoin(1)
+    style = {}
+    for layer in page.layers:
+        for stroke in layer.strokes:
+            if stroke.is_highlighter:
+                _draw_stroke(can, style, page.palette, stroke)
+        for stroke in layer.strokes:
+            if not stroke.is_highlighter:
+                _draw_stroke(can, style, page.palette, stroke)
+
+    can.showPage()
+    stats["draw_time"] += time.perf_counter() - start_time
+    return canvas_offset
+
+
+def thumbnail(rm_file_name, width=DEFAULT_THUMBNAIL_WIDTH, is_landscape=False, files=None):
+    """ Returns a Pillow image with the strokes of the given .rm file
+        (without extension) that is width pixels wide. In contrast to
+        _render_rm_files_to_bytes no pdf is created, so this is fast
+        enough to preview pages. Thumbnails are cached by the hash of
+        the page.
+    """
+    page_layout = PDFPageLayout(is_landscape=is_landscape)
+    sources = _get_page_sources(rm_file_name, page_layout, None, files)
+    key = hashlib.sha1(json.dumps(
+        [THUMBNAIL_CACHE_VERSION, width, sources], sort_keys=True).encode()).hexdigest()
+
+    thumbnail_cache = ThumbnailCache()
+    cached = thumbnail_cache.load(key)
+    if cached is not None:
+        try:
+            image = Image.open(io.BytesIO(cached))
+            image.load()
+            return image
+        except Exception as e:
+            print("(Warning) Invalid thumbnail cache entry %s" % key)
+            print(e)
+
+    image = _render_rm_file_to_image(rm_file_name, page_layout, width, files)
+    packet = io.BytesIO()
+    image.save(packet, "PNG")
+    thumbnail_cache.store(key, packet.getvalue())
+    return image
 
-    can.save()
-    packet.seek(0)
-    overlay = PdfReader(packet)
 
-    return overlay, canvas_offset
+def thumbnails(rm_files_path, pages, is_landscape=False, width=DEFAULT_THUMBNAIL_WIDTH, max_pages=None, files=None):
+    """ Returns (page_nr, image) of the first max_pages annotated pages
+        (see thumbnail). The .rm files are named by page number or by
+        page id (pages).
+    """
+    files = DiskFiles() if files is None else files
+    num_pages = len(pages) if pages else float("inf")
+    annotated = _get_annotated_pages(rm_files_path, pages, num_pages, files)
+    return [(page_nr, thumbnail(rm_file_name, width, is_landscape, files=files))
+            for page_nr, rm_file_name in annotated[:max_pages]]
+
+
+def _render_rm_file_to_image(rm_file_name, page_layout, width, files=None):
+    page = _load_page(rm_file_name, page_layout, files)
+
+    scale = width / page_layout.width
+    height = max(1, int(round(page_layout.height * scale)))
+    image = Image.new("RGB", (width, height), "white")
+
+    # Draw with RGBA colors such that translucent strokes are blended
+    draw = ImageDraw.Draw(image, "RGBA")
+    palette = [tuple(int(round(255 * c)) for c in color.rgb()) for color in page.palette]
+    for layer in page.layers:
+        for stroke in layer.strokes:
+            if stroke.is_highlighter:
+                _draw_stroke_to_image(draw, palette, stroke, page_layout, scale)
+        for stroke in layer.strokes:
+            if not stroke.is_highlighter:
+                _draw_stroke_to_image(draw, palette, stroke, page_layout, scale)
+
+    return image
+
+
+def _draw_stroke_to_image(draw, palette, stroke, page_layout, scale):
+    """ Same as _draw_stroke for Pillow images: consecutive segments with
+        the same color, width and opacity are drawn as a single line.
+    """
+    n = len(stroke)
+    if n < 2:
+        return
+
+    x = (stroke.x - page_layout.x_start) * scale
+    y = (page_layout.y_end - stroke.y) * scale
+    points = np.column_stack((x, y)).ravel().tolist()
+
+    # Style of segment i (from point i to point i+1)
+    widths = np.maximum(np.round(stroke.widths[1:] * scale), 1).astype(np.int64)
+    alphas = np.round(np.clip(stroke.opacities[1:], 0, 1) * 255).astype(np.int64)
+    colors = stroke.colors[1:]
+    changes = np.flatnonzero(
+        (widths[1:] != widths[:-1]) |
+        (alphas[1:] != alphas[:-1]) |
+        (colors[1:] != colors[:-1])) + 1
+
+    starts = [0] + changes.tolist()
+    ends = changes.tolist() + [n - 1]
+    for start, end in zip(starts, ends):
+        alpha = int(alphas[start])
+        if alpha == 0:
+            continue
+        fill = palette[colors[start]] + (alpha,)
+        draw.line(points[2*start:2*end+2], fill=fill, width=int(widths[start]), joint="curve")
+
+
+def _draw_stroke(can, style, palette, stroke):
+    """ Draw a stroke where segment i goes from point i-1 to point i. Opaque
+        consecutive segments with the same color, width and opacity are drawn
+        as a single polyline. Translucent segments are drawn one by one
+        because their overlaps should become darker (e.g. highlighter).
+        style holds the current state of the canvas to emit state
+        operators only if a value changes.
+    """
+    x = stroke.x.tolist()
+    y = stroke.y.tolist()
+    widths = stroke.widths.tolist()
+    opacities = stroke.opacities.tolist()
+    colors = stroke.colors.tolist()
+
+    n = len(x)
+    i = 1
+    while i < n:
+        color = colors[i]
+        width = widths[i]
+        opacity = opacities[i]
+
+        end = i + 1
+        if opacity >= 1:
+            while (end < n and widths[end] == width and opacities[end] == opacity
+                    and colors[end] == color):
+                end += 1
+
+        _set_stroke_style(can, style, palette, color, width, opacity)
+        p = can.beginPath()
+        p.moveTo(x[i-1], y[i-1])
+        for k in range(i, end):
+            p.lineTo(x[k], y[k])
+        can.drawPath(p)
+        i = end
+
+
+def _set_stroke_style(can, style, palette, color, width, opacity):
+    if style.get("color") != color:
+        # Note that setting the color also sets the alpha of the color
+        can.setStrokeColor(palette[color], alpha=opacity)
+        style["color"] = color
+        style["opacity"] = opacity
+    elif style["opacity"] != opacity:
+        can.setStrokeAlpha(opacity)
+        style["opacity"] = opacity
+
+    if style.get("width") != width:
+        can.setLineWidth(width)
+        style["width"] = width
+
+
+#
+# STROKE MODEL
+#
+class Palette:
+    """ Colors of a page. Strokes store indices into the palette instead
+        of a color object per point.
+    """
+
+    def __init__(self):
+        self.colors = []
+        self.indices = {}
+
+
+    def __len__(self):
+        return len(self.colors)
+
+
+    def __getitem__(self, index):
+        return self.colors[index]
+
+
+    def index(self, color):
+        """ Returns the index of the given color (reportlab color or rgb(a)
+            tuple) and adds it to the palette if it is new.
+        """
+        is_color = isinstance(color, colors.Color)
+        key = color.rgba() if is_color else tuple(color)
+        index = self.indices.get(key)
+        if index is None:
+            index = len(self.colors)
+            self.colors.append(color if is_color else _get_color(color))
+            self.indices[key] = index
+        return index
+
+
+class Stroke:
+    """ Stroke in page coordinates. All columns are numpy arrays with one
+        entry per point: x, y, widths and opacities (float64) and colors
+        (int32 indices into the palette of the page). Segment i goes from
+        point i-1 to point i and is drawn with width, opacity and color i.
+    """
+
+    def __init__(self, pen_nr, is_highlighter, x, y, widths, opacities, colors):
+        self.pen_nr = pen_nr
+        self.is_highlighter = is_highlighter
+        self.x = x
+        self.y = y
+        self.widths = widths
+        self.opacities = opacities
+        self.colors = colors
+
+
+    def __len__(self):
+        return len(self.x)
+
+
+class Layer:
+    def __init__(self, strokes):
+        self.strokes = strokes
+
+
+class Page:
+    """ Strokes of a single .rm file in page coordinates, ready to be drawn
+        by a renderer. Erasers are not part of the page.
+    """
+
+    def __init__(self, page_layout, layers, palette):
+        self.page_layout = page_layout
+        self.layers = layers
+        self.palette = palette
+
+
+    def strokes(self):
+        for layer in self.layers:
+            yield from layer.strokes
+
+
+    def get_bounds(self):
+        """ Returns (min_x, min_y, max_x, max_y) of the page and all strokes.
+        """
+        min_x, max_x = self.page_layout.x_start, self.page_layout.x_end
+        min_y, max_y = self.page_layout.y_start, self.page_layout.y_end
+        for stroke in self.strokes():
+            if len(stroke) == 0:
+                continue
+            min_x = min(min_x, float(stroke.x.min()))
+            max_x = max(max_x, float(stroke.x.max()))
+            min_y = min(min_y, float(stroke.y.min()))
+            max_y = max(max_y, float(stroke.y.max()))
+        return min_x, min_y, max_x, max_y
+
+
+def _load_page(rm_file_name, page_layout, files=None, stats=None):
+    """ Returns the Page of the given .rm file (without extension). The
+        time to parse the file and to compute the pens is added to stats.
+    """
+    files = DiskFiles() if files is None else files
+    rm_file = "%s.rm" % rm_file_name
+    rm_file_metadata = "%s-metadata.json" % rm_file_name
+
+    start_time = time.perf_counter()
+    data = files.read(rm_file)
+
+    try:
+        rm_layers = lines.read_layers(data)
+    except lines.LinesFileError as e:
+        print("(Warning) Could not read %s" % rm_file)
+        print(e)
+        rm_layers = []
+
+    palette = Palette()
+    layer_colors = _load_layer_colors(rm_file_metadata, len(rm_layers), files)
+    layer_colors = [None if c is None else palette.index(c) for c in layer_colors]
+    parse_end_time = time.perf_counter()
+
+    layers = []
+    for layer, rm_strokes in enumerate(rm_layers):
+        strokes = []
+        for rm_stroke in rm_strokes:
+            stroke = _load_stroke(rm_stroke, page_layout, palette, layer_colors[layer])
+            if stroke is not None:
+                strokes.append(stroke)
+        layers.append(Layer(strokes))
+
+    if stats is not None:
+        stats["parse_time"] += parse_end_time - start_time
+        stats["pen_time"] += time.perf_counter() - parse_end_time
+    return Page(page_layout, layers, palette)
+
+
+def _load_layer_colors(rm_file_metadata, nlayers, files):
+    """ Load name of layers; if layer name starts with # we use this color
+        for this layer
+    """
+    layer_colors = [None for _ in range(nlayers)]
+    if not files.exists(rm_file_metadata):
+        return layer_colors
+
+    layers = json.loads(files.read(rm_file_metadata))["layers"]
+
+    for l in range(min(len(layers), nlayers)):
+        layer = layers[l]
+
+        matches = re.search(r"#([^\s]+)", layer["name"], re.M | re.I)
+        if not matches:
+            continue
+        color_code = matches[0].lower()
+
+        # Try to parse hex code
+        try:
+            has_alpha = len(color_code) > 7
+            layer_colors[l] = colors.HexColor(color_code, hasAlpha=has_alpha)
+            continue
+        except:
+            pass
+
+        # Try to get from name
+        color_code = color_code[1:]
+        color_names = colors.getAllNamedColors()
+        if color_code in color_names:
+            layer_colors[l] = color_names[color_code]
+
+        # No valid color found... automatic fallback to default
+
+    return layer_colors
+
+
+def _load_stroke(rm_stroke, page_layout, palette, layer_color=None):
+    """ Returns the Stroke of a decoded stroke of an .rm file or None if
+        the stroke should not be drawn (erasers and unknown pens).
+    """
+    pen_nr = rm_stroke["pen_nr"]
+    pen = _get_pen(pen_nr, page_layout.scale, rm_stroke["pen_width"], rm_stroke["color"])
+    if pen is None or isinstance(pen, (Eraser, EraseArea)):
+        return None
+
+    columns = (rm_stroke["speed"], rm_stroke["tilt"], rm_stroke["width"], rm_stroke["pressure"])
+    segment_widths = pen.get_widths(*columns)
+    segment_opacities = pen.get_opacities(*columns)
+    if layer_color is None:
+        layer_color = palette.index(pen.base_color)
+    segment_colors = np.full(len(segment_widths), layer_color, dtype=np.int32)
+
+    # Transform all points of the stroke into page coordinates at once
+    x_pos = rm_stroke["x"].astype(np.float64)
+    y_pos = rm_stroke["y"].astype(np.float64)
+    if page_layout.is_landscape:
+        render_xpos = page_layout.x_end - page_layout.scale * y_pos
+        render_ypos = page_layout.y_end - page_layout.scale * x_pos
+    else:
+        render_xpos = page_layout.x_start + page_layout.scale * x_pos
+        render_ypos = page_layout.y_end - page_layout.scale * y_pos
+
+    return Stroke(
+        pen_nr,
+        isinstance(pen, Highlighter),
+        render_xpos,
+        render_ypos,
+        segment_widths,
+        segment_opacities,
+        segment_colors)
+
+
+def _simplify_stroke(stroke, tolerance):
+    """ Ramer-Douglas-Peucker simplification of the stroke: Points closer
+        than tolerance (in page coordinates) to the simplified polyline are
+        dropped. Points where width, opacity or color change are kept, so
+        every segment is still drawn with its original style.
+    """
+    n = len(stroke)
+    if n < 3:
+        return stroke
+
+    x, y = stroke.x, stroke.y
+    widths, opacities, colors = stroke.widths, stroke.opacities, stroke.colors
+
+    # Segment i ends at point i, so point i is kept if segment i+1 is drawn differently
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    keep[1:-1] = ((widths[2:] != widths[1:-1]) |
+                  (opacities[2:] != opacities[1:-1]) |
+                  (colors[2:] != colors[1:-1]))
+
+    kept = np.flatnonzero(keep).tolist()
+    ranges = list(zip(kept[:-1], kept[1:]))
+    while ranges:
+        start, end = ranges.pop()
+        if end - start < 2:
+            continue
+
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        px = x[start+1:end] - x[start]
+        py = y[start+1:end] - y[start]
+        length = np.hypot(dx, dy)
+        if length > 0:
+            distances = np.abs(dx * py - dy * px) / length
+        else:
+            distances = np.hypot(px, py)
+
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            point = start + 1 + i
+            keep[point] = True
+            ranges.append((start, point))
+            ranges.append((point, end))
+
+    return Stroke(
+        stroke.pen_nr, stroke.is_highlighter,
+        x[keep], y[keep], widths[keep], opacities[keep], colors[keep])
+
+
+def _get_pen(pen_nr, scale, width, color):
+    """ Returns the pen for both, v3 and v5 pen numbers or None if unknown.
+        https://support.remarkable.com/hc/en-us/articles/115004558545-5-1-Tools-Overview
+    """
+    if pen_nr in (7, 13):
+        return Mechanical_Pencil(scale, width, color)
+    if pen_nr in (1, 14):
+        return Pencil(scale, width, color)
+    if pen_nr in (0, 12):
+        return Brush(scale, width, color)
+    if pen_nr in (2, 15):
+        return Ballpoint(scale, width, color)
+    if pen_nr in (4, 17):
+        return Fineliner(scale, width, color)
+    if pen_nr in (3, 16):
+        return Marker(scale, width, color)
+    if pen_nr == 21:
+        return Calligraphy(scale, width, color)
+    if pen_nr in (5, 18):
+        return Highlighter(scale, 30, color)
+    if pen_nr == 6:
+        return Eraser(scale, width, color)
+    if pen_nr == 8:
+        return EraseArea(scale, width, color)
+
+    print('Unknown pen: {}'.format(pen_nr))
+    return None
 
 
 def _get_color(color):
@@ -481,7 +1408,7 @@ class Pen:
         return self.base_width * self.ratio
 
     def get_segment_color(self, speed, tilt, width, pressure, last_width):
-        return _get_color(self.base_color)
+        return self.base_color
 
     def get_segment_opacity(self, speed, tilt, width, pressure, last_width):
         return self.base_opacity
@@ -490,6 +1417,27 @@ class Pen:
         """return value in [0, 1]"""
         return max(0, min(1, value))
 
+    def get_widths(self, speed, tilt, width, pressure):
+        """ Width of every point of a stroke (arrays with one entry per point).
+            As in the scalar version, the width changes every segment_length
+            points only.
+        """
+        sampled = _sample_segments(self.segment_length, speed, tilt, width, pressure)
+        return _expand_segments(self.get_segment_widths(*sampled), self.segment_length, len(speed))
+
+    def get_opacities(self, speed, tilt, width, pressure):
+        sampled = _sample_segments(self.segment_length, speed, tilt, width, pressure)
+        return _expand_segments(self.get_segment_opacities(*sampled), self.segment_length, len(speed))
+
+    def get_segment_widths(self, speed, tilt, width, pressure):
+        """ Array version of get_segment_width for the sampled points
+            of a stroke.
+        """
+        return np.full(len(speed), self.base_width * self.ratio, dtype=np.float64)
+
+    def get_segment_opacities(self, speed, tilt, width, pressure):
+        return np.full(len(speed), self.base_opacity, dtype=np.float64)
+
 
 class Fineliner(Pen):
     def __init__(self, ratio, base_width, base_color):
@@ -508,6 +1456,10 @@ class Ballpoint(Pen):
         segment_width = (0.5 + pressure) + (1 * width) - 0.5 * (speed / 50)
         return segment_width * self.ratio
 
+    def get_segment_widths(self, speed, tilt, width, pressure):
+        segment_width = (0.5 + pressure) + (1 * width) - 0.5 * (speed / 50)
+        return segment_width * self.ratio
+
     # def get_segment_color(self, speed, tilt, width, pressure, last_width):
     #     intensity = (0.1 * -(speed / 35)) + (1.2 * pressure) + 0.5
     #     intensity = self.cutoff(intensity)
@@ -527,6 +1479,10 @@ class Marker(Pen):
         segment_width = 0.9 * (((1 * width)) - 0.4 * tilt) + (0.1 * last_width)
         return segment_width * self.ratio
 
+    def get_segment_widths(self, speed, tilt, width, pressure):
+        segment_width = 0.9 * (((1 * width)) - 0.4 * tilt)
+        return _linear_recurrence(segment_width * self.ratio, 0.1 * self.ratio)
+
 
 class Pencil(Pen):
     def __init__(self, ratio, base_width, base_color):
@@ -546,6 +1502,17 @@ class Pencil(Pen):
         segment_opacity = max(0.05, min(0.7, pressure ** 3))
         return self.cutoff(segment_opacity)
 
+    def get_segment_widths(self, speed, tilt, width, pressure):
+        segment_width = 0.5 * ((((0.8 * self.base_width) + (0.5 * pressure)) * (1 * width)) - (
+                0.25 * tilt ** 1.8))
+        max_width = self.base_width * 10
+        segment_width = np.minimum(segment_width, max_width)
+        return segment_width * self.ratio
+
+    def get_segment_opacities(self, speed, tilt, width, pressure):
+        segment_opacity = np.clip(pressure ** 3, 0.05, 0.7)
+        return np.clip(segment_opacity, 0, 1)
+
 
 class Mechanical_Pencil(Pen):
     def __init__(self, ratio, base_width, base_color):
@@ -568,6 +1535,11 @@ class Brush(Pen):
                 ((1 + (1.4 * pressure)) * (1 * width)) - (0.5 * tilt) - (0.5 * speed / 50))  # + (0.2 * last_width)
         return segment_width * self.ratio
 
+    def get_segment_widths(self, speed, tilt, width, pressure):
+        segment_width = 0.7 * (
+                ((1 + (1.4 * pressure)) * (1 * width)) - (0.5 * tilt) - (0.5 * speed / 50))
+        return segment_width * self.ratio
+
     # def get_segment_color(self, speed, tilt, width, pressure, last_width):
     #     intensity = (pressure ** 1.5  - 0.2 * (speed / 50))*1.5
     #     intensity = self.cutoff(intensity)
@@ -585,7 +1557,7 @@ class Highlighter(Pen):
     def __init__(self, ratio, base_width, base_color):
         super().__init__(ratio, base_width, base_color)
         self.stroke_cap = "square"
-        self.base_opacity = 0.0
+        self.base_opacity = 0.1
         self.name = "Highlighter"
         self.segment_length = 2
 
@@ -618,3 +1590,34 @@ class Calligraphy(Pen):
     def get_segment_width(self, speed, tilt, width, pressure, last_width):
         segment_width = 0.5 * (((1 + pressure) * (1 * width)) - 0.3 * tilt) + (0.2 * last_width)
         return segment_width * self.ratio
+
+    def get_segment_widths(self, speed, tilt, width, pressure):
+        segment_width = 0.5 * (((1 + pressure) * (1 * width)) - 0.3 * tilt)
+        return _linear_recurrence(segment_width * self.ratio, 0.2 * self.ratio)
+
+
+def _sample_segments(segment_length, *columns):
+    """ Points of a stroke where the pen computes a new width/opacity.
+    """
+    return [np.asarray(c, dtype=np.float64)[::segment_length] for c in columns]
+
+
+def _expand_segments(values, segment_length, n):
+    """ Hold every sampled value for the next segment_length points.
+    """
+    return np.repeat(values, segment_length)[:n]
+
+
+def _linear_recurrence(a, c):
+    """ Returns w with w[0] = a[0] and w[i] = a[i] + c * w[i-1], which is the
+        last_width feedback of the pens. Computed as a scan in log2(n) steps
+        where step k adds the contribution of the point 2^k positions back.
+    """
+    w = np.array(a, dtype=np.float64)
+    shift = 1
+    factor = c
+    while shift < len(w) and factor != 0:
+        w[shift:] += factor * w[:-shift]
+        factor *= factor
+        shift *= 2
+    return w
@@ -13,6 +13,7 @@ from gui.settings import Settings
 
 import api.remarkable_client
 from api.remarkable_client import RemarkableClient
+from model.render import RenderService
 import utils.config
 
 class Main(object):
@@ -92,6 +93,9 @@ class Main(object):
 def main():
     window = tk.Tk(className="RemaPy")
     Path(utils.config.PATH).mkdir(parents=True, exist_ok=True)
+
+    # Documents are rendered in worker processes which are started now
+    RenderService().start()
     app = Main(window)
     window.mainloop()
 
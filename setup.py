@@ -14,7 +14,7 @@ setup(
     url="https://github.com/peerdavid/remapy",
     author="David Peer",
     packages=find_packages(where="."),
-    python_requires=">=3.6, <4",
+    python_requires=">=3.7, <4",
     install_requires=[
         "numpy",
         "Pillow",
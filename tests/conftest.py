@@ -0,0 +1,21 @@
+import pytest
+
+import utils.config as cfg
+from tests import http_server
+
+
+@pytest.fixture
+def server():
+    """ Local stand-in for the rm cloud (see http_server).
+    """
+    with http_server.serve({"/": b"ok"}) as server:
+        yield server
+
+
+@pytest.fixture(autouse=True)
+def cache_path(monkeypatch, tmp_path):
+    """ Tests must not read or write the user's cache.
+    """
+    path = tmp_path / "cache"
+    monkeypatch.setattr(cfg, "CACHE_PATH", path)
+    return path
@@ -0,0 +1,25 @@
+import os
+
+from utils.cache import DiskCache
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(tmp_path, max_size=100)
+    for i, key in enumerate("abcde"):
+        cache.store(key, key.encode() * 20)
+        os.utime(tmp_path / key, (1000 + i, 1000 + i))
+    assert cache.load("a") == b"a" * 20
+
+    # Exceeds max_size and evicts b, c and d which are used least recently
+    cache.store("f", b"f" * 20)
+    assert [key for key in "abcdef" if cache.load(key) is not None] == ["a", "e", "f"]
+
+
+def test_disk_cache_size_of_overwritten_entries(tmp_path):
+    cache = DiskCache(tmp_path, max_size=100)
+    cache.store("a", b"a" * 40)
+    for _ in range(5):
+        cache.store("b", b"b" * 40)
+
+    assert cache._size == 80
+    assert cache.load("a") == b"a" * 40
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import zipfile
+
+import utils.config as cfg
+from model.collection import Collection
+from model.document import Document
+from tests import rm_generator
+
+
+def create_document(id):
+    metadata = {
+        "ID": id,
+        "VissibleName": id,
+        "Parent": "",
+        "Type": "DocumentType",
+        "Version": 1,
+        "ModifiedClient": "2020-01-01T00:00:00Z",
+        "Bookmarked": False,
+        "CurrentPage": 0,
+    }
+    root = Collection(dict(metadata, ID="", Type="CollectionType"), None)
+    root.sync = lambda: None
+    return Document(metadata, root)
+
+
+def test_thumbnails_of_synced_document(monkeypatch, tmp_path):
+    monkeypatch.setattr(cfg, "PATH", tmp_path / "data")
+    rm_generator.annotated_pdf(tmp_path / "blob", "doc", pages=3, annotated_pages=[0, 2])
+
+    raw_file = tempfile.TemporaryFile()
+    with zipfile.ZipFile(raw_file, "w") as zip_file:
+        for path in (tmp_path / "blob").rglob("*"):
+            zip_file.write(path, path.relative_to(tmp_path / "blob"))
+    raw_file.seek(0)
+
+    document = create_document("doc")
+    document.sync(raw_file)
+
+    # Only the top level files are extracted, the .rm files are kept in one archive
+    assert sorted(p.name for p in (tmp_path / "data" / "doc").iterdir()) == \
+            [".remapy", "doc.content", "doc.pdf"]
+    assert (tmp_path / "data" / "doc" / ".remapy" / "pages.zip").exists()
+
+    thumbnails = document.thumbnails(width=50)
+    assert [page_nr for page_nr, _ in thumbnails] == [0, 2]
+    assert all(image.width == 50 for _, image in thumbnails)
+
+
+def test_oap_file_of_document_synced_without_overlays(monkeypatch, tmp_path):
+    monkeypatch.setattr(cfg, "PATH", tmp_path / "data")
+    document = create_document("doc")
+    assert document.oap_file() is None
+
+    os.makedirs(document.path_remapy)
+    with open(document.path_oap_pdf, "wb") as f:
+        f.write(b"%PDF-1.3")
+    assert document.oap_file() == document.path_oap_pdf
@@ -0,0 +1,87 @@
+""" Local stand-in for the rm cloud. Responses are served from
+    server.blobs (path including the query -> bytes) and every request
+    is recorded. Faults are injected with server.faults (path -> list of
+    (status, headers) that are answered first); status None closes the
+    connection without a response.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.headers.append(dict(self.headers))
+            server.paths.append(self.path)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            faults = server.faults.get(self.path)
+            fault = faults.pop(0) if faults else None
+
+        try:
+            time.sleep(server.delay)
+            if fault is not None:
+                self._send_fault(*fault)
+                return
+
+            body = server.blobs.get(self.path)
+            if body is None:
+                self.send_response(404)
+                body = b""
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.do_GET()
+
+    do_PUT = do_POST
+
+    def _send_fault(self, status, headers):
+        if status is None:
+            self.close_connection = True
+            return
+
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def serve(blobs=None, delay=0):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.blobs = {} if blobs is None else blobs
+    server.delay = delay
+    server.lock = threading.Lock()
+    server.connections = set()
+    server.headers = []
+    server.paths = []
+    server.faults = {}
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.url = "http://127.0.0.1:%d" % server.server_address[1]
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,60 @@
+from pdfrw import PdfReader
+
+import model.render as render
+from tests import rm_generator
+
+
+def test_annotated_pdf_is_updated_incrementally(tmp_path):
+    args = rm_generator.annotated_pdf(tmp_path, "document", pages=30, annotated_pages=[0, 7, 22])
+    rm_files_path, path_original_pdf = args[0], args[3]
+    path_annotated_pdf = tmp_path / "annotated.pdf"
+    path_render = str(tmp_path / "render")
+
+    render.pdf(*args, path_annotated_pdf, None, path_render=path_render)
+    first = path_annotated_pdf.read_bytes()
+    assert first.startswith(path_original_pdf.read_bytes())
+
+    # Nothing changed, nothing is written
+    render.pdf(*args, path_annotated_pdf, None, path_render=path_render)
+    assert path_annotated_pdf.read_bytes() == first
+
+    # Only the changed pages are appended
+    (rm_files_path / "7.rm").write_bytes(rm_generator.rm_file(seed=99))
+    (rm_files_path / "22.rm").unlink()
+    render.pdf(*args, path_annotated_pdf, None, path_render=path_render)
+    second = path_annotated_pdf.read_bytes()
+    assert second.startswith(first)
+    assert second.count(b"%%EOF") == first.count(b"%%EOF") + 1
+
+    annotated_pdf = PdfReader(str(path_annotated_pdf))
+    original_pdf = PdfReader(str(path_original_pdf))
+    assert len(annotated_pdf.pages) == 30
+    assert annotated_pdf.pages[22].Contents.stream == original_pdf.pages[22].Contents.stream
+    for page_nr in (0, 7):
+        assert annotated_pdf.pages[page_nr].Resources.XObject is not None
+
+
+def test_only_changed_pages_are_rendered(monkeypatch, tmp_path):
+    args = rm_generator.annotated_pdf(tmp_path, "document", pages=10, annotated_pages=[1, 3, 5, 8])
+    rm_files_path = args[0]
+    path_render = str(tmp_path / "render")
+
+    rendered = []
+    render_rm_files_to_bytes = render._render_rm_files_to_bytes
+    def count_rendered(jobs):
+        rendered.extend(job[0] for job in jobs)
+        return render_rm_files_to_bytes(jobs)
+    monkeypatch.setattr(render, "_render_rm_files_to_bytes", count_rendered)
+
+    render.pdf(*args, tmp_path / "annotated.pdf", None, path_render=path_render)
+    assert len(rendered) == 4
+
+    rendered.clear()
+    render.pdf(*args, tmp_path / "annotated.pdf", None, path_render=path_render)
+    assert rendered == []
+
+    (rm_files_path / "3.rm").write_bytes(rm_generator.rm_file(seed=99))
+    (rm_files_path / "9.rm").write_bytes(rm_generator.rm_file(seed=98))
+    rendered.clear()
+    render.pdf(*args, tmp_path / "annotated.pdf", None, path_render=path_render)
+    assert sorted(rendered) == ["%s/%d" % (rm_files_path, page) for page in (3, 9)]
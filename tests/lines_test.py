@@ -0,0 +1,88 @@
+import mmap
+import struct
+from pathlib import Path
+
+import pytest
+
+from model import lines
+from tests import rm_generator
+
+INPUT_BASE_PATH = Path("testcases/")
+
+
+def _struct_layers(data):
+    """ Same decoding as used by the renderer before the numpy reader
+    """
+    is_v3 = data[:len(lines.HEADER_V3)] == lines.HEADER_V3
+    offset = len(lines.HEADER_V3)
+    (nlayers,) = struct.unpack_from('<I', data, offset)
+    offset += 4
+
+    layers = []
+    for _ in range(nlayers):
+        (strokes_count,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        strokes = []
+        for _ in range(strokes_count):
+            fmt = '<IIIfI' if is_v3 else '<IIIffI'
+            values = struct.unpack_from(fmt, data, offset)
+            offset += struct.calcsize(fmt)
+            pen_nr, color, width, segments_count = values[0], values[1], values[3], values[-1]
+
+            segments = []
+            for _ in range(segments_count):
+                segments.append(struct.unpack_from('<ffffff', data, offset))
+                offset += struct.calcsize('<ffffff')
+            strokes.append((pen_nr, color, width, segments))
+        layers.append(strokes)
+    return layers
+
+
+def test_same_strokes_as_struct_decoding():
+    rm_files = sorted(INPUT_BASE_PATH.glob("annotation/*/*/*.rm")) + sorted(INPUT_BASE_PATH.glob("notebook/*/*/*.rm"))
+    assert len(rm_files) > 0
+
+    sources = [rm_file.read_bytes() for rm_file in rm_files]
+    sources += [rm_generator.rm_file(version, layers=2) for version in (3, 5)]
+    for data in sources:
+        layers = lines.read_layers(data)
+        expected = _struct_layers(data)
+
+        assert len(layers) == len(expected)
+        for strokes, expected_strokes in zip(layers, expected):
+            assert len(strokes) == len(expected_strokes)
+            for stroke, (pen_nr, color, width, segments) in zip(strokes, expected_strokes):
+                assert (stroke["pen_nr"], stroke["color"], stroke["pen_width"]) == (pen_nr, color, width)
+                columns = list(zip(*[stroke[name].tolist() for name in lines.SEGMENT_DTYPE.names]))
+                assert columns == segments
+
+
+def test_iter_strokes_from_mmap(tmp_path):
+    data = rm_generator.rm_file(5, layers=3, strokes_per_layer=4, points_per_stroke=25)
+    path = tmp_path / "0.rm"
+    path.write_bytes(data)
+
+    expected = lines.read_layers(data)
+    # Same usage as documented, the mmap is closed at the end
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+        strokes = [(layer, stroke["x"].copy()) for layer, stroke in lines.iter_strokes(source, layers=[1])]
+        layers = [(layer, strokes_count) for layer, strokes_count, _ in lines.iter_layers(source)]
+    assert source.closed
+
+    assert layers == [(0, 4), (1, 4), (2, 4)]
+    assert [(layer, x.tolist()) for layer, x in strokes] == \
+            [(1, stroke["x"].tolist()) for stroke in expected[1]]
+
+
+def test_invalid_files_raise():
+    data = rm_generator.rm_file(3, layers=1, strokes_per_layer=2, points_per_stroke=10)
+    assert lines.get_version(data) == 3
+
+    with pytest.raises(lines.LinesFileError):
+        lines.read_layers(b"not a reMarkable file" * 4)
+    with pytest.raises(lines.LinesFileError):
+        lines.read_layers(data[:-8])
+    with pytest.raises(lines.LinesFileError):
+        list(lines.iter_layers(data[:len(lines.HEADER_V3) + 10]))
+    with pytest.raises(lines.LinesFileError):
+        lines.read_layers(lines.HEADER_V5 + b"\xff\xff\xff\xff" + bytes(12))
@@ -0,0 +1,33 @@
+import re
+
+from PIL import Image
+
+import model.render as render
+from tests import rm_generator
+
+
+def test_templates_are_built_and_written_once(monkeypatch, tmp_path):
+    path_templates = tmp_path / "templates"
+    path_templates.mkdir()
+    Image.new("RGB", (render.DEFAULT_IMAGE_WIDTH, render.DEFAULT_IMAGE_HEIGHT), "gray").save(
+        str(path_templates / "Blank.png"))
+
+    built = []
+    load_template_pdf = render._load_template_pdf
+    def count_built(template_path, mtime):
+        built.append(template_path)
+        return load_template_pdf(template_path, mtime)
+    monkeypatch.setattr(render, "_load_template_pdf", count_built)
+    monkeypatch.setattr(render, "_templates", {})
+
+    for uuid in ("first", "second"):
+        rm_generator.notebook(tmp_path, uuid, pages=5)
+        path_annotated_pdf = tmp_path / ("%s.pdf" % uuid)
+        render.notebook(str(tmp_path), uuid, str(path_annotated_pdf), False,
+                path_templates=str(path_templates))
+
+        # The image of the template is shared by all pages
+        images = re.findall(rb"/Subtype\s*/Image", path_annotated_pdf.read_bytes())
+        assert len(images) == 1
+
+    assert built == [str(path_templates / "Blank.png")]
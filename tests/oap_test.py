@@ -0,0 +1,46 @@
+import io
+import os
+
+from reportlab import rl_config
+
+import model.render as render
+from tests import rm_generator
+
+
+def test_oap_from_render_manifest(monkeypatch, tmp_path):
+    monkeypatch.setattr(rl_config, "invariant", 1)
+    args = rm_generator.annotated_pdf(tmp_path, "document", pages=12, annotated_pages=[1, 4, 11])
+    path_render = tmp_path / "render"
+    path_oap_pdf = tmp_path / "oap.pdf"
+
+    oap_pdf = io.BytesIO()
+    render.pdf(*args, tmp_path / "annotated.pdf", oap_pdf, path_render=str(path_render))
+    assert render.oap(str(path_render), args[3], str(path_oap_pdf)) == str(path_oap_pdf)
+    assert path_oap_pdf.read_bytes() == oap_pdf.getvalue()
+
+    # Written only once as long as the annotations do not change
+    mtime = os.stat(path_oap_pdf).st_mtime_ns
+    render.pdf(*args, tmp_path / "annotated.pdf", None, path_render=str(path_render))
+    render.oap(str(path_render), args[3], str(path_oap_pdf))
+    assert os.stat(path_oap_pdf).st_mtime_ns == mtime
+
+    # Changed strokes
+    (args[0] / "1.rm").write_bytes(rm_generator.rm_file(seed=99))
+    oap_pdf = io.BytesIO()
+    render.pdf(*args, tmp_path / "annotated.pdf", oap_pdf, path_render=str(path_render))
+    render.oap(str(path_render), args[3], str(path_oap_pdf))
+    assert path_oap_pdf.read_bytes() == oap_pdf.getvalue()
+
+    (args[0] / "4.rm").unlink()
+    oap_pdf = io.BytesIO()
+    render.pdf(*args, tmp_path / "annotated.pdf", oap_pdf, path_render=str(path_render))
+    render.oap(str(path_render), args[3], str(path_oap_pdf))
+    assert path_oap_pdf.read_bytes() == oap_pdf.getvalue()
+
+
+def test_oap_without_annotations(tmp_path):
+    args = rm_generator.annotated_pdf(tmp_path, "document", pages=3, annotated_pages=[])
+    path_render = tmp_path / "render"
+
+    render.pdf(*args, tmp_path / "annotated.pdf", None, path_render=str(path_render))
+    assert render.oap(str(path_render), args[3], str(tmp_path / "oap.pdf")) is None
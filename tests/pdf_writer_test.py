@@ -0,0 +1,105 @@
+import io
+
+from pdfrw import PdfReader, PdfDict, PdfName, IndirectPdfDict
+from reportlab.pdfgen import canvas
+
+from model.pdf_reader import LazyPdfReader
+from model.pdf_writer import PdfStreamWriter, PdfUpdateWriter
+
+
+def create_pdf_data(num_pages):
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=(200, 300))
+    for i in range(num_pages):
+        can.drawString(10, 10, "Page %d" % i)
+        can.showPage()
+    can.save()
+    return packet.getvalue()
+
+
+def create_pdf(num_pages):
+    return PdfReader(io.BytesIO(create_pdf_data(num_pages)))
+
+
+def get_loaded_pages(pdf):
+    return [obj for obj in pdf.indirect_objects.values() if getattr(obj, "Type", None) == PdfName.Page]
+
+
+def test_stream_writer_keeps_pages_and_shared_objects(tmp_path):
+    base_pdf = create_pdf(5)
+    path = tmp_path / "out.pdf"
+
+    with PdfStreamWriter(path) as writer:
+        writer.reserve(base_pdf.pages)
+        for page in base_pdf.pages:
+            writer.addpage(page)
+
+    out_pdf = PdfReader(str(path))
+    assert len(out_pdf.pages) == 5
+    for page, base_page in zip(out_pdf.pages, base_pdf.pages):
+        assert page.Contents.stream == base_page.Contents.stream
+        assert page.MediaBox == base_page.MediaBox
+
+    # The font is shared by all pages and written only once
+    fonts = set(id(page.Resources.Font.F1) for page in out_pdf.pages)
+    assert len(fonts) == 1
+
+
+def test_update_writer_appends_replaced_pages_only(tmp_path):
+    data = create_pdf_data(5)
+    base_pdf = LazyPdfReader(io.BytesIO(data))
+    path = tmp_path / "out.pdf"
+    assert PdfUpdateWriter.is_supported(data, base_pdf)
+
+    page = base_pdf.pages[3]
+    new_page = IndirectPdfDict(Type=PdfName.Page, MediaBox=page.MediaBox, Resources=PdfDict())
+    new_page.stream = "0 0 m 10 10 l S"
+    with PdfUpdateWriter(path, data, base_pdf) as writer:
+        writer.addpage(base_pdf.pages[0])
+        writer.addpage(new_page, original=page)
+
+    out_data = path.read_bytes()
+    assert out_data.startswith(data)
+    assert out_data.count(b"%%EOF") == 2
+
+    out_pdf = PdfReader(str(path))
+    old_pdf = create_pdf(5)
+    assert len(out_pdf.pages) == 5
+    assert out_pdf.pages[3].stream == "0 0 m 10 10 l S"
+    for i in (0, 1, 2, 4):
+        assert out_pdf.pages[i].Contents.stream == old_pdf.pages[i].Contents.stream
+
+
+def test_update_writer_without_replaced_pages(tmp_path):
+    data = create_pdf_data(3)
+    base_pdf = LazyPdfReader(io.BytesIO(data))
+    path = tmp_path / "out.pdf"
+
+    with PdfUpdateWriter(path, data, base_pdf) as writer:
+        writer.addpage(base_pdf.pages[1])
+
+    assert path.read_bytes().rstrip(b"\n") == data.rstrip(b"\n")
+    assert len(PdfReader(str(path)).pages) == 3
+
+    # Pages can still be replaced later on
+    page = base_pdf.pages[2]
+    new_page = IndirectPdfDict(Type=PdfName.Page, MediaBox=page.MediaBox, Resources=PdfDict())
+    new_page.stream = "0 0 m 10 10 l S"
+    with PdfUpdateWriter.append(path, base_pdf, writer.startxref, writer.objnum) as writer:
+        writer.addpage(new_page, original=page)
+    assert PdfReader(str(path)).pages[2].stream == "0 0 m 10 10 l S"
+
+
+def test_lazy_reader_loads_single_pages(tmp_path):
+    data = create_pdf_data(50)
+    base_pdf = LazyPdfReader(io.BytesIO(data))
+    old_pdf = create_pdf(50)
+
+    # Only page 42 is loaded, pdfrw loads all pages
+    assert len(base_pdf.pages) == 50
+    base_pdf.pages[42]
+    assert len(get_loaded_pages(base_pdf)) == 1
+    assert len(get_loaded_pages(old_pdf)) == 50
+
+    assert base_pdf.pages[42].Contents.stream == old_pdf.pages[42].Contents.stream
+    assert [p.Contents.stream for p in base_pdf.pages[-3:]] == [p.Contents.stream for p in old_pdf.pages[-3:]]
@@ -0,0 +1,77 @@
+import numpy as np
+
+import model.render as render
+
+PENS = [
+    render.Pen, render.Fineliner, render.Ballpoint, render.Marker,
+    render.Pencil, render.Mechanical_Pencil, render.Brush,
+    render.Highlighter, render.Eraser, render.EraseArea, render.Calligraphy]
+
+
+def _scalar_widths_and_opacities(pen, speed, tilt, width, pressure):
+    """ Same loop as used by the renderer before pens were vectorized
+    """
+    last_width = 0
+    widths = []
+    opacities = []
+    segments = zip(speed.tolist(), tilt.tolist(), width.tolist(), pressure.tolist())
+    for segment, (s, t, w, p) in enumerate(segments):
+        if segment % pen.segment_length == 0:
+            segment_width = pen.get_segment_width(s, t, w, p, last_width)
+            segment_opacity = pen.get_segment_opacity(s, t, w, p, last_width)
+        widths.append(segment_width)
+        opacities.append(segment_opacity)
+        last_width = segment_width
+    return widths, opacities
+
+
+def test_vectorized_pens_match_scalar_pens():
+    rng = np.random.default_rng(0)
+    for n in (0, 1, 2, 7, 1000):
+        speed = rng.uniform(0, 100, n).astype(np.float32)
+        tilt = rng.uniform(0, 1.5, n).astype(np.float32)
+        width = rng.uniform(1, 5, n).astype(np.float32)
+        pressure = rng.uniform(0, 1, n).astype(np.float32)
+
+        for pen_class in PENS:
+            for ratio in (0.8, 1.5):
+                pen = pen_class(ratio, 2.0, 0)
+                expected_widths, expected_opacities = _scalar_widths_and_opacities(
+                    pen, speed, tilt, width, pressure)
+
+                widths = pen.get_widths(speed, tilt, width, pressure)
+                opacities = pen.get_opacities(speed, tilt, width, pressure)
+                assert np.allclose(widths, expected_widths, rtol=1e-9, atol=1e-12)
+                assert np.allclose(opacities, expected_opacities, rtol=1e-9, atol=1e-12)
+
+
+def test_linear_recurrence():
+    a = np.arange(1, 100, dtype=np.float64)
+    expected = []
+    last = 0
+    for value in a:
+        last = value + 0.3 * last
+        expected.append(last)
+    assert np.allclose(render._linear_recurrence(a, 0.3), expected)
+
+
+def test_pen_numbers():
+    # Pens as chosen by the renderer before pens were vectorized
+    expected = {
+        0: render.Brush, 12: render.Brush,
+        1: render.Pencil, 14: render.Pencil,
+        2: render.Ballpoint, 15: render.Ballpoint,
+        3: render.Marker, 16: render.Marker,
+        4: render.Fineliner, 17: render.Fineliner,
+        5: render.Highlighter, 18: render.Highlighter,
+        6: render.Eraser,
+        7: render.Mechanical_Pencil, 13: render.Mechanical_Pencil,
+        8: render.EraseArea,
+        21: render.Calligraphy,
+    }
+    for pen_nr in range(25):
+        pen = render._get_pen(pen_nr, 1.0, 2.0, 0)
+        if pen_nr in expected:
+            assert type(pen) is expected[pen_nr]
+        else:
+            assert pen is None
@@ -0,0 +1,101 @@
+import json
+import os
+import time
+
+import pytest
+
+import api.remarkable_client
+from api.remarkable_client import RemarkableClient
+
+
+def test_requests_reuse_connections_and_token(monkeypatch, server):
+    client = RemarkableClient()
+    headers = client.http.headers
+    client.http.set_user_token("token")
+
+    def load():
+        raise AssertionError("Config loaded for a request")
+    monkeypatch.setattr(api.remarkable_client.cfg, "load", load)
+
+    try:
+        for _ in range(5):
+            assert RemarkableClient()._request("GET", server.url, headers={"x-test": "1"}).text == "ok"
+    finally:
+        client.http.headers = headers
+
+    assert len(server.connections) == 1
+    assert all(h["Authorization"] == "Bearer token" for h in server.headers)
+    assert all(h["x-test"] == "1" for h in server.headers)
+
+
+def test_get_raw_file(cache_path, server):
+    blob = os.urandom(3 * 1024 * 1024 + 7)
+    server.blobs["/blob"] = blob
+
+    with RemarkableClient().get_raw_file(server.url + "/blob", chunk_size=64 * 1024) as raw_file:
+        assert raw_file.read() == blob
+
+    with pytest.raises(IOError):
+        RemarkableClient().get_raw_file(server.url + "/missing")
+
+    # Temporary files are deleted
+    assert list((cache_path / "downloads").iterdir()) == []
+
+
+def blob_items(urls, expires_in=3600):
+    expires = time.strftime("%Y-%m-%dT%H:%M:%S.123456789Z", time.gmtime(time.time() + expires_in))
+    return json.dumps([{"ID": id, "BlobURLGet": url, "BlobURLGetExpires": expires}
+            for id, url in urls.items()]).encode()
+
+
+def test_blob_urls_are_refreshed_when_stale(monkeypatch, server):
+    monkeypatch.setattr(api.remarkable_client, "LIST_DOCS_URL", server.url + "/docs")
+    server.blobs["/docs?withBlob=True"] = blob_items({"fresh": "url 1"})
+    client = RemarkableClient()
+
+    assert client.get_blob_url("fresh") == "url 1"
+    assert client.get_blob_url("fresh") == "url 1"
+    assert len(server.paths) == 1
+
+    # Expires too soon to be used
+    server.blobs["/docs?withBlob=True"] = blob_items({"stale": "url 2"}, expires_in=10)
+    server.blobs["/docs?doc=stale&withBlob=True"] = blob_items({"stale": "url 3"})
+    assert client.get_blob_url("stale") == "url 3"
+    assert client.get_blob_url("stale") == "url 3"
+    assert len(server.paths) == 3
+
+
+def test_download_all(monkeypatch, server):
+    monkeypatch.setattr(api.remarkable_client, "LIST_DOCS_URL", server.url + "/docs")
+    server.delay = 0.05
+
+    urls = {}
+    for i in range(20):
+        server.blobs["/blob/%d" % i] = b"blob %d" % i
+        urls["doc %d" % i] = "%s/blob/%d" % (server.url, i)
+    urls["doc 20"] = "http://127.0.0.1:1/blob/20"
+    server.blobs["/docs?withBlob=True"] = blob_items(urls)
+
+    processed = {}
+    def process(id, raw_file):
+        if id == "doc 0":
+            raise ValueError("Broken blob")
+        processed[id] = raw_file.read()
+
+    client = RemarkableClient()
+    monkeypatch.setattr(client.http.transport, "max_retries", 0)
+    errors = client.download_all(urls.keys(), process, max_downloads=4, max_workers=2)
+
+    assert sorted(errors) == ["doc 0", "doc 20"]
+    assert isinstance(errors["doc 0"], ValueError)
+    assert processed == {"doc %d" % i: b"blob %d" % i for i in range(1, 20)}
+    assert server.max_in_flight == 4
+
+    # Urls of all documents are requested at once
+    assert server.paths.count("/docs?withBlob=True") == 1
+
+
+def test_parse_expires():
+    utc = api.remarkable_client._parse_expires("2020-06-04T10:29:43.123456789Z")
+    assert utc == 1591266583
+    assert api.remarkable_client._parse_expires("2020-06-04T11:29:43.5+01:00") == utc
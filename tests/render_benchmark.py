@@ -0,0 +1,171 @@
+""" Benchmark of render.pdf and render.notebook with generated .rm files
+    (see rm_generator). The time spent to parse, compute the pens, draw,
+    merge and write (see render._new_render_stats) as well as the total time and the peak
+    memory are compared with a JSON baseline and regressions are flagged.
+
+    Usage (from the root of the repository):
+        python -m tests.render_benchmark [--pages 20] [--strokes 50] ...
+        python -m tests.render_benchmark --save
+        python -m tests.render_benchmark --simplify-tolerance 0.5
+
+    If no baseline exists or --save is given, the results are stored
+    as new baseline (by default in the cache folder of RemaPy). Baselines are only compared if they were created
+    with the same arguments.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import model.render as render
+import utils.config as cfg
+from tests import rm_generator
+
+DEFAULT_BASELINE = cfg.CACHE_PATH / "render_baseline.json"
+METRICS = ["parse_time", "pen_time", "draw_time", "merge_time", "write_time", "total_time", "peak_memory_mb"]
+
+# Differences below these values are noise and never a regression
+MIN_TIME_DIFF = 0.005
+MIN_MEMORY_DIFF = 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark render.pdf and render.notebook")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--strokes", type=int, default=50, help="Strokes per layer")
+    parser.add_argument("--points", type=int, default=200, help="Points per stroke")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.2,
+        help="Relative slowdown that is flagged as regression")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="Store results as new baseline")
+    parser.add_argument("--simplify-tolerance", type=float, default=0,
+        help="Render with render.simplify_tolerance set to this value")
+    args = parser.parse_args()
+
+    config = {
+        "pages": args.pages,
+        "layers": args.layers,
+        "strokes_per_layer": args.strokes,
+        "points_per_stroke": args.points,
+    }
+    baseline_config = dict(config, simplify_tolerance=args.simplify_tolerance)
+
+    path = Path(tempfile.mkdtemp(prefix="remapy-benchmark-"))
+    try:
+        # Don't use the user's cache. Worker processes (render.workers)
+        # read the cache path from the env.
+        os.environ["XDG_CACHE_HOME"] = str(path / "cache")
+        cfg.CACHE_PATH = path / "cache" / "remapy"
+
+        # The user's config with the simplify tolerance of the benchmark
+        user_config = cfg.load()
+        os.environ["XDG_CONFIG_HOME"] = str(path / "config")
+        Path(path / "config" / "remapy").mkdir(parents=True)
+        render_config = dict(user_config.get("render") or {}, simplify_tolerance=args.simplify_tolerance)
+        cfg.save(dict(user_config, render=render_config))
+
+        results = {}
+        for version in (3, 5):
+            results["pdf_v%d" % version] = _benchmark_pdf(path / ("pdf_v%d" % version), version, config, args.repeat)
+            results["notebook_v%d" % version] = _benchmark_notebook(path / ("notebook_v%d" % version), version, config, args.repeat)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    _print_results(results)
+
+    baseline = None
+    if args.baseline.exists():
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    regressions = []
+    if baseline is not None and baseline["config"] == baseline_config:
+        regressions = _get_regressions(baseline["results"], results, args.threshold)
+        for name, metric, old, new in regressions:
+            print("(Regression) %s %s: %.3f -> %.3f" % (name, metric, old, new))
+        if not regressions:
+            print("No regressions compared to %s" % args.baseline)
+    elif baseline is not None:
+        print("(Warning) Baseline %s was created with other arguments" % args.baseline)
+
+    if baseline is None or args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({"config": baseline_config, "results": results}, f, indent=2, sort_keys=True)
+        print("Saved baseline %s" % args.baseline)
+
+    return 1 if regressions else 0
+
+
+def _benchmark_pdf(path, version, config, repeat):
+    args = rm_generator.annotated_pdf(path, "document", version=version, **config)
+    path_annotated_pdf = path / "annotated.pdf"
+    path_oap_pdf = path / "oap.pdf"
+    return _benchmark(lambda: render.pdf(*args, path_annotated_pdf, path_oap_pdf), path_annotated_pdf, repeat)
+
+
+def _benchmark_notebook(path, version, config, repeat):
+    rm_generator.notebook(path, "notebook", version=version, **config)
+    path_annotated_pdf = path / "annotated.pdf"
+    return _benchmark(lambda: render.notebook(path, "notebook", path_annotated_pdf, False), path_annotated_pdf, repeat)
+
+
+def _benchmark(run, path_pdf, repeat):
+    """ Returns the best result of all runs for every metric. The peak
+        memory is measured in an additional run because tracing slows
+        down rendering.
+    """
+    result = {}
+    for _ in range(repeat):
+        shutil.rmtree(cfg.CACHE_PATH, ignore_errors=True)
+        start_time = time.perf_counter()
+        stats = run()
+        stats["total_time"] = time.perf_counter() - start_time
+        for metric in METRICS[:-1]:
+            result[metric] = min(result.get(metric, stats[metric]), stats[metric])
+
+    shutil.rmtree(cfg.CACHE_PATH, ignore_errors=True)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result["peak_memory_mb"] = peak / 1024 / 1024
+    result["size_kb"] = os.path.getsize(path_pdf) / 1024
+    result["points_drawn"] = stats["points_drawn"]
+    return result
+
+
+def _get_regressions(baseline, results, threshold):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        for metric in METRICS:
+            old = baseline[name].get(metric)
+            new = result[metric]
+            min_diff = MIN_MEMORY_DIFF if metric == "peak_memory_mb" else MIN_TIME_DIFF
+            if old is not None and new > old * (1 + threshold) and new - old > min_diff:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def _print_results(results):
+    columns = METRICS + ["size_kb", "points_drawn"]
+    print("%-12s %s" % ("", " ".join("%14s" % c for c in columns)))
+    for name, result in results.items():
+        print("%-12s %s" % (name, " ".join("%14.3f" % result[c] for c in columns)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from pdfrw import PdfReader
+
+import model.render as render
+from model.render import RenderService, RenderError
+from tests import rm_generator
+
+
+def test_render_service_survives_failing_jobs():
+    service = RenderService()
+    assert service.result(service.submit(os.getpid), 30) != os.getpid()
+    restarts = service.restarts
+
+    with pytest.raises(RenderError):
+        service.result(service.submit(os._exit, 1), 30)
+    with pytest.raises(RenderError):
+        service.result(service.submit(time.sleep, 60), 1)
+    if render.resource is not None and render.cfg.get("render.worker_memory_mb", 2048):
+        with pytest.raises(RenderError):
+            service.result(service.submit(bytearray, 64 * 1024 ** 3), 30)
+
+    assert service.restarts == restarts + 2
+    assert service.result(service.submit(os.getpid), 30) != os.getpid()
+
+
+def test_timeout_starts_with_the_job():
+    service = RenderService()
+    service.result(service.submit(os.getpid), 30)
+    restarts = service.restarts
+
+    # All jobs are running for the pool, but the last one waits for a worker
+    futures = [service.submit(time.sleep, 0.6) for _ in range(service.workers + 1)]
+    for future in reversed(futures):
+        service.result(future, 1)
+    assert service.restarts == restarts
+
+
+def test_isolated_render_skips_broken_pages(tmp_path):
+    args = rm_generator.annotated_pdf(tmp_path, "document", pages=4)
+
+    # Rendering this page fails in the worker
+    broken_rm_file = args[0] / "2.rm"
+    broken_rm_file.unlink()
+    broken_rm_file.mkdir()
+
+    path_annotated_pdf = tmp_path / "annotated.pdf"
+    path_oap_pdf = tmp_path / "oap.pdf"
+    render.pdf(*args, path_annotated_pdf, path_oap_pdf, isolate=True)
+
+    assert len(PdfReader(str(path_annotated_pdf)).pages) == 4
+    assert len(PdfReader(str(path_oap_pdf)).pages) == 3
+
+
+@pytest.mark.skipif(render.resource is None, reason="Memory limits are not supported")
+def test_worker_memory_limit_below_hard_limit():
+    hard_limit = 1500 * 1024 * 1024
+    code = "\n".join([
+        "import resource",
+        "import model.render as render",
+        "resource.setrlimit(resource.RLIMIT_AS, (%d, %d))" % (hard_limit, hard_limit),
+        "render._init_render_worker(2048, None)",
+        "print(*resource.getrlimit(resource.RLIMIT_AS))",
+    ])
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    assert output.split() == [str(hard_limit), str(hard_limit)]
@@ -0,0 +1,89 @@
+import json
+import struct
+from pathlib import Path
+
+import numpy as np
+from reportlab.pdfgen import canvas
+
+from model.lines import HEADER_V3, HEADER_V5, STROKE_FMT_V3, STROKE_FMT_V5, SEGMENT_DTYPE
+from model.render import DEFAULT_IMAGE_WIDTH, DEFAULT_IMAGE_HEIGHT
+
+# Pens (v5 numbers) used for generated strokes, including the pens with
+# a last_width feedback (marker, calligraphy) and the highlighter
+PENS = [15, 16, 17, 12, 13, 14, 18, 21]
+
+
+def rm_file(version=5, layers=1, strokes_per_layer=10, points_per_stroke=100, seed=0):
+    """ Returns the content of a valid .rm file (v3 or v5) with random
+        handwriting like strokes.
+    """
+    rng = np.random.default_rng(seed)
+    header = HEADER_V3 if version == 3 else HEADER_V5
+    stroke_fmt = STROKE_FMT_V3 if version == 3 else STROKE_FMT_V5
+
+    data = [struct.pack("<%dsI" % len(header), header, layers)]
+    for _ in range(layers):
+        data.append(struct.pack("<I", strokes_per_layer))
+        for _ in range(strokes_per_layer):
+            pen_nr = int(rng.choice(PENS))
+            color = int(rng.integers(0, 3))
+            width = float(rng.choice([1.875, 2.0, 2.125]))
+            if version == 3:
+                data.append(struct.pack(stroke_fmt, pen_nr, color, 0, width, points_per_stroke))
+            else:
+                data.append(struct.pack(stroke_fmt, pen_nr, color, 0, width, 0., points_per_stroke))
+
+            segments = np.zeros(points_per_stroke, dtype=SEGMENT_DTYPE)
+            angle = np.cumsum(rng.normal(0, 0.3, points_per_stroke))
+            start = rng.uniform(0, [DEFAULT_IMAGE_WIDTH, DEFAULT_IMAGE_HEIGHT])
+            segments["x"] = np.clip(start[0] + np.cumsum(2 * np.cos(angle)), 0, DEFAULT_IMAGE_WIDTH)
+            segments["y"] = np.clip(start[1] + np.cumsum(2 * np.sin(angle)), 0, DEFAULT_IMAGE_HEIGHT)
+            segments["speed"] = rng.uniform(0, 60, points_per_stroke)
+            segments["tilt"] = rng.uniform(0, 1.5, points_per_stroke)
+            segments["width"] = rng.uniform(1.5, 3, points_per_stroke)
+            segments["pressure"] = rng.uniform(0.1, 1, points_per_stroke)
+            data.append(segments.tobytes())
+
+    return b"".join(data)
+
+
+def notebook(path, uuid, pages=10, version=5, layers=1, strokes_per_layer=10, points_per_stroke=100):
+    """ Creates the files of a notebook (as downloaded from the cloud) with
+        the given number of pages in path.
+    """
+    rm_files_path = Path(path) / uuid
+    rm_files_path.mkdir(parents=True, exist_ok=True)
+    for page in range(pages):
+        data = rm_file(version, layers, strokes_per_layer, points_per_stroke, seed=page)
+        (rm_files_path / ("%d.rm" % page)).write_bytes(data)
+
+    (Path(path) / ("%s.pagedata" % uuid)).write_text("Blank\n" * pages)
+
+
+def annotated_pdf(path, uuid, pages=10, annotated_pages=None, version=5, layers=1,
+        strokes_per_layer=10, points_per_stroke=100):
+    """ Creates the files of an annotated pdf (as downloaded from the
+        cloud) in path. By default, all pages are annotated. Returns the
+        arguments of render.pdf except the output files.
+    """
+    path = Path(path)
+    rm_files_path = path / uuid
+    rm_files_path.mkdir(parents=True, exist_ok=True)
+
+    path_original_pdf = path / ("%s.pdf" % uuid)
+    can = canvas.Canvas(str(path_original_pdf), pagesize=(595, 842))
+    for page in range(pages):
+        can.drawString(72, 770, "Page %d" % (page + 1))
+        can.showPage()
+    can.save()
+
+    annotated_pages = range(pages) if annotated_pages is None else annotated_pages
+    for page in annotated_pages:
+        data = rm_file(version, layers, strokes_per_layer, points_per_stroke, seed=page)
+        (rm_files_path / ("%d.rm" % page)).write_bytes(data)
+
+    page_ids = ["page-%d" % page for page in range(pages)]
+    (path / ("%s.content" % uuid)).write_text(json.dumps({"pages": page_ids}))
+
+    path_highlighter = path / ("%s.highlights" % uuid)
+    return rm_files_path, path_highlighter, page_ids, path_original_pdf
@@ -0,0 +1,24 @@
+from model import lines
+import model.render as render
+from tests import rm_generator
+
+
+def test_generated_rm_files_are_valid():
+    for version in (3, 5):
+        data = rm_generator.rm_file(version, layers=3, strokes_per_layer=4, points_per_stroke=25)
+        layers = lines.read_layers(data)
+
+        assert len(layers) == 3
+        for strokes in layers:
+            assert len(strokes) == 4
+            for stroke in strokes:
+                assert stroke["pen_nr"] in rm_generator.PENS
+                assert len(stroke["x"]) == 25
+
+
+def test_render_generated_notebook(tmp_path):
+    rm_generator.notebook(tmp_path, "notebook", pages=3, strokes_per_layer=5, points_per_stroke=20)
+    stats = render.notebook(tmp_path, "notebook", tmp_path / "notebook.pdf", False)
+
+    assert stats["points"] == 3 * 5 * 20
+    assert (tmp_path / "notebook.pdf").exists()
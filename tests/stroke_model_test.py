@@ -0,0 +1,78 @@
+from pathlib import Path
+
+import numpy as np
+from reportlab.lib import colors
+
+import model.render as render
+from tests import rm_generator
+
+INPUT_BASE_PATH = Path("testcases/")
+
+
+def test_load_page_columns():
+    for rm_file in sorted(INPUT_BASE_PATH.glob("*/*/*/*.rm")):
+        page = render._load_page(str(rm_file)[:-3], render.PDFPageLayout())
+
+        assert len(page.layers) > 0
+        for stroke in page.strokes():
+            n = len(stroke)
+            for column in (stroke.x, stroke.y, stroke.widths, stroke.opacities):
+                assert column.shape == (n,) and column.dtype == np.float64
+            assert stroke.colors.dtype == np.int32
+            assert np.all((stroke.colors >= 0) & (stroke.colors < len(page.palette)))
+
+
+def test_palette_reuses_colors():
+    palette = render.Palette()
+    black = palette.index(render.default_stroke_color[0])
+    red = palette.index(colors.HexColor("#ff0000"))
+
+    assert palette.index(render.default_stroke_color[0]) == black
+    assert palette.index(colors.HexColor("#ff0000")) == red
+    assert len(palette) == 2
+    assert palette[red].rgb() == (1, 0, 0)
+
+
+def test_thumbnail():
+    rm_file = sorted(INPUT_BASE_PATH.glob("annotation/*/*/*.rm"))[0]
+    image = render.thumbnail(str(rm_file)[:-3], width=200)
+
+    assert image.size == (200, 267)
+    assert image.convert("L").getextrema()[0] < 128
+
+    # Second call is served from the cache
+    cached = render.thumbnail(str(rm_file)[:-3], width=200)
+    assert cached.convert("RGB").tobytes() == image.tobytes()
+
+
+def test_simplify_stroke_keeps_style_changes():
+    n = 100
+    x = np.linspace(0, 99, n)
+    y = np.zeros(n)
+    y[50] = 10.0
+    widths = np.where(np.arange(n) < 30, 1.0, 2.0)
+    stroke = render.Stroke(
+        2, False, x, y, widths, np.ones(n), np.zeros(n, dtype=np.int32))
+
+    simplified = render._simplify_stroke(stroke, tolerance=0.5)
+
+    # Start, end, the peak and both ends of the segment where the width changes
+    assert simplified.x.tolist() == [0, 29, 49, 50, 51, 99]
+    assert simplified.widths.tolist() == [1, 1, 2, 2, 2, 2]
+
+
+def test_simplify_tolerance_is_read_once_per_document(monkeypatch, tmp_path):
+    args = rm_generator.annotated_pdf(tmp_path, "document", pages=6, annotated_pages=[0, 2, 3, 5])
+    config_get = render.cfg.get
+    reads = []
+
+    def get(config_path, default=None):
+        if config_path == "render.simplify_tolerance":
+            reads.append(config_path)
+            return 0.5
+        return config_get(config_path, default)
+    monkeypatch.setattr(render.cfg, "get", get)
+
+    stats = render.pdf(*args, tmp_path / "annotated.pdf", None)
+    assert len(reads) == 1
+    assert 0 < stats["points_drawn"] < stats["points"]
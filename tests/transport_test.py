@@ -0,0 +1,53 @@
+import time
+
+import pytest
+import requests
+
+from api.transport import Transport, TokenBucket
+
+
+def test_transient_faults_are_retried(server):
+    server.faults["/"] = [(503, {}), (None, {}), (429, {"Retry-After": "1"}), (500, {})]
+    transport = Transport(retries=5, backoff=0.01)
+
+    start = time.monotonic()
+    response = transport.request("GET", server.url + "/")
+    assert response.status_code == 200
+    assert response.text == "ok"
+    assert time.monotonic() - start >= 1
+    assert transport.stats() == {"retries": 4, "throttles": 1}
+
+
+def test_retries_are_limited(server):
+    server.faults["/"] = [(503, {})] * 3
+    transport = Transport(retries=2, backoff=0.01)
+
+    assert transport.request("GET", server.url + "/").status_code == 503
+    assert len(server.paths) == 3
+
+    server.faults["/"] = [(None, {})] * 3
+    with pytest.raises(requests.ConnectionError):
+        transport.request("GET", server.url + "/")
+
+
+def test_only_throttled_posts_are_retried(server):
+    server.faults["/"] = [(429, {"Retry-After": "0"}), (503, {})]
+    transport = Transport(retries=5, backoff=0.01)
+
+    assert transport.request("POST", server.url + "/", data=b"data").status_code == 503
+    assert transport.stats() == {"retries": 1, "throttles": 1}
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(20)
+
+    start = time.monotonic()
+    for _ in range(30):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.45
+
+    bucket.block(0.3)
+    start = time.monotonic()
+    TokenBucket(0).acquire()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.25
@@ -0,0 +1,55 @@
+import io
+import json
+import zipfile
+from pathlib import Path
+
+from reportlab import rl_config
+
+import model.render as render
+from model.files import DiskFiles, ZipFiles
+
+INPUT_BASE_PATH = Path("testcases/")
+
+
+def _zip_folder(path):
+    """ Same layout as the zip of a document downloaded from the cloud
+    """
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as zip_file:
+        for file in sorted(path.rglob("*")):
+            if file.is_file():
+                zip_file.write(file, file.relative_to(path).as_posix())
+    return zipfile.ZipFile(data, "r")
+
+
+def _render_pdf(path, id, files=None):
+    files = DiskFiles() if files is None else files
+    rm_files_path = path / id
+    pages = json.loads(files.read(str(path / ("%s.content" % id))))["pages"]
+
+    annotated_pdf = io.BytesIO()
+    oap_pdf = io.BytesIO()
+    render.pdf(
+        str(rm_files_path), str(path / ("%s.highlights" % id)), pages,
+        str(path / ("%s.pdf" % id)), annotated_pdf, oap_pdf, files=files)
+    return annotated_pdf.getvalue(), oap_pdf.getvalue()
+
+
+def test_render_from_zip_equals_render_from_disk(monkeypatch, tmp_path):
+    monkeypatch.setattr(rl_config, "invariant", 1)
+
+    # The zip is mapped to a folder that does not exist, so nothing is read from disk
+    for path in sorted(INPUT_BASE_PATH.glob("annotation/*")):
+        id = path.name
+        files = ZipFiles(_zip_folder(path), str(tmp_path / id))
+        assert files.exists(str(tmp_path / id / id))
+        assert _render_pdf(tmp_path / id, id, files) == _render_pdf(path, id)
+
+    for path in sorted(INPUT_BASE_PATH.glob("notebook/*")):
+        id = path.name
+        files = ZipFiles(_zip_folder(path), str(tmp_path / id))
+        from_zip = io.BytesIO()
+        from_disk = io.BytesIO()
+        render.notebook(str(tmp_path / id), id, from_zip, False, files=files)
+        render.notebook(str(path), id, from_disk, False)
+        assert from_zip.getvalue() == from_disk.getvalue()
@@ -0,0 +1,101 @@
+import os
+import threading
+import uuid
+from pathlib import Path
+
+
+class DiskCache(object):
+    """ Size limited key value store on disk. Every entry is a single file
+        and the modification time of the file is used to evict the least
+        recently used entries once max_size (in bytes) is exceeded.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = Path(path)
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+
+    def load(self, key):
+        """ Returns the stored bytes for the given key or None.
+        """
+        path = self._get_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+
+        return data
+
+
+    def store(self, key, data):
+        path = self._get_path(key)
+        tmp_path = path.with_name("%s.%s.tmp" % (path.name, uuid.uuid4().hex))
+
+        try:
+            old_size = path.stat().st_size
+        except OSError:
+            old_size = 0
+
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print("(Warning) Failed to write cache entry %s" % key)
+            print(e)
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._get_size()
+            else:
+                self._size += len(data) - old_size
+
+            if self._size > self.max_size:
+                self._evict()
+
+
+    def _get_path(self, key):
+        return self.path / key
+
+
+    def _get_entries(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+
+    def _get_size(self):
+        return sum(size for _, size, _ in self._get_entries())
+
+
+    def _evict(self):
+        """ Remove least recently used entries until the cache uses at most
+            3/4 of max_size such that we don't evict on every store.
+        """
+        entries = self._get_entries()
+        entries.sort()
+        size = sum(size for _, size, _ in entries)
+        for _, entry_size, entry_path in entries:
+            if size <= self.max_size * 0.75:
+                break
+
+            try:
+                os.remove(entry_path)
+                size -= entry_size
+            except OSError:
+                pass
+
+        self._size = size
@@ -7,6 +7,10 @@ PATH = Path.joinpath(Path.home(), ".remapy", "data")
 if "XDG_DATA_HOME" in os.environ:
     PATH = Path.joinpath(Path(os.getenv("XDG_DATA_HOME")), "remapy")
 
+CACHE_PATH = Path.joinpath(Path.home(), ".remapy", "cache")
+if "XDG_CACHE_HOME" in os.environ:
+    CACHE_PATH = Path.joinpath(Path(os.getenv("XDG_CACHE_HOME")), "remapy")
+
 
 def save(new_config: dict) -> None:
     """ Updates a complete section!